@@ -0,0 +1,318 @@
+"""Change driven alerts
+
+Evaluate alert rules on the rows and fields changed by a write to the stocks
+table. Only rules depending on a changed field are evaluated, and only for the
+changed rows. Triggered alerts are delivered to pluggable sinks.
+
+Usage:
+    engine = AlertEngine()
+    engine.add_rule(ThresholdRule("cheap", "peRatioTTM", "<", 15, watchlist_only=True))
+    engine.add_sink(LoggingSink())
+    db_handler.add_change_listener(engine.on_changes)
+"""
+import abc
+import logging
+import operator
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class Change:
+    """
+    Changed fields of a single row of the stocks table.
+
+    Attributes:
+        isin (str): ISIN of the changed row.
+        changed (Dict[str, Tuple[Any, Any]]): Old and new value per changed field.
+        row (Dict[str, Any]): Row after the change.
+    """
+
+    def __init__(self, isin: str, changed: Dict[str, Tuple[Any, Any]], row: Dict[str, Any]):
+        """
+        Initializes the Change.
+
+        Args:
+            isin (str): ISIN of the changed row
+            changed (Dict[str, Tuple[Any, Any]]): Old and new value per changed field
+            row (Dict[str, Any]): Row after the change
+        """
+        self.isin = isin
+        self.changed = changed
+        self.row = row
+
+    def old_row(self) -> Dict[str, Any]:
+        """
+        Returns the row as it was before the change.
+
+        Returns:
+            Dict[str, Any]: Row with the old values of the changed fields
+        """
+        return {**self.row, **{field: values[0] for field, values in self.changed.items()}}
+
+    def __repr__(self) -> str:
+        return f"Change({self.isin!r}, {self.changed!r})"
+
+
+def diff_rows(
+    rows: Dict[str, Dict[str, Any]],
+    old_rows: Dict[str, Dict[str, Any]],
+    new_rows: Dict[str, Dict[str, Any]],
+) -> List[Change]:
+    """
+    Determines the changed fields of updated rows of the stocks table.
+
+    Args:
+        rows (Dict[str, Dict[str, Any]]): Written column-value pairs per ISIN
+        old_rows (Dict[str, Dict[str, Any]]): Stored rows before the update
+        new_rows (Dict[str, Dict[str, Any]]): Stored rows after the update
+
+    Returns:
+        List[Change]: Changes of the rows with at least one changed field
+    """
+    changes = []
+    for isin, new_row in new_rows.items():
+        changed = {column: (old_rows[isin][column], new_row[column]) for column in rows[isin]
+                   if old_rows[isin][column] != new_row[column]}
+        if changed:
+            changes.append(Change(isin, changed, new_row))
+    return changes
+
+
+class Rule:  # pylint: disable=too-few-public-methods
+    """
+    Alert rule on one or more fields of the stocks table.
+
+    A rule triggers when its condition becomes true by a change, i.e. it is true
+    for the row after the change and was false before.
+
+    Attributes:
+        name (str): Name of the rule.
+        fields (List[str]): Fields the condition depends on.
+        condition (Callable[[Dict[str, Any]], bool]): Condition evaluated on a row.
+        watchlist_only (bool): Evaluate the rule only for stocks in the watchlist.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        fields: List[str],
+        condition: Callable[[Dict[str, Any]], bool],
+        watchlist_only: bool = False,
+    ):
+        """
+        Initializes the Rule.
+
+        Args:
+            name (str): Name of the rule
+            fields (List[str]): Fields the condition depends on
+            condition (Callable[[Dict[str, Any]], bool]): Condition evaluated on a row
+            watchlist_only (bool, optional): Evaluate only for stocks in the watchlist. Defaults to False.
+        """
+        self.name = name
+        self.fields = list(fields)
+        self.condition = condition
+        self.watchlist_only = watchlist_only
+
+    def _holds(self, row: Dict[str, Any]) -> bool:
+        """
+        Evaluates the condition, a row with missing values never matches.
+
+        Args:
+            row (Dict[str, Any]): Row to evaluate
+
+        Returns:
+            bool: True if the condition holds
+        """
+        if any(row.get(field) is None for field in self.fields):
+            return False
+        return bool(self.condition(row))
+
+    def triggered(self, change: Change) -> bool:
+        """
+        Checks if a change makes the condition true.
+
+        Args:
+            change (Change): Change of a row
+
+        Returns:
+            bool: True if the rule triggers
+        """
+        if self.watchlist_only and change.row.get("watchlist") in (None, "", "0", 0, False):
+            return False
+        return self._holds(change.row) and not self._holds(change.old_row())
+
+
+class ThresholdRule(Rule):  # pylint: disable=too-few-public-methods
+    """
+    Alert rule comparing a single field with a threshold, e.g. peRatioTTM < 15.
+    """
+
+    _OPERATORS = {"<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge}
+
+    def __init__(self, name: str, field: str, compare: str, threshold: float, watchlist_only: bool = False):
+        """
+        Initializes the ThresholdRule.
+
+        Args:
+            name (str): Name of the rule
+            field (str): Field to compare
+            compare (str): Comparison operator, one of "<", "<=", ">", ">="
+            threshold (float): Threshold to compare with
+            watchlist_only (bool, optional): Evaluate only for stocks in the watchlist. Defaults to False.
+
+        Raises:
+            ValueError: Unknown comparison operator
+        """
+        if compare not in self._OPERATORS:
+            raise ValueError(f"Unknown comparison operator: {compare}")
+        compare_function = self._OPERATORS[compare]
+        super().__init__(name, [field], lambda row: compare_function(row[field], threshold), watchlist_only)
+        self.compare = compare
+        self.threshold = threshold
+
+
+class Alert:  # pylint: disable=too-few-public-methods
+    """
+    Alert of a triggered rule.
+
+    Attributes:
+        rule (Rule): Triggered rule.
+        change (Change): Change that triggered the rule.
+    """
+
+    def __init__(self, rule: Rule, change: Change):
+        """
+        Initializes the Alert.
+
+        Args:
+            rule (Rule): Triggered rule
+            change (Change): Change that triggered the rule
+        """
+        self.rule = rule
+        self.change = change
+
+    def __str__(self) -> str:
+        values = ", ".join(f"{field}={self.change.row.get(field)}" for field in self.rule.fields)
+        return f"{self.rule.name}: {self.change.row.get('symbol') or self.change.isin} ({values})"
+
+
+class AlertSink(abc.ABC):  # pylint: disable=too-few-public-methods
+    """
+    Base class of alert receivers.
+    """
+
+    @abc.abstractmethod
+    def send(self, alert: Alert) -> None:
+        """
+        Delivers an alert.
+
+        Args:
+            alert (Alert): Alert to deliver
+        """
+
+
+class LoggingSink(AlertSink):  # pylint: disable=too-few-public-methods
+    """
+    Writes alerts to the log.
+    """
+
+    def send(self, alert: Alert) -> None:
+        logger.warning("Alert %s", alert)
+
+
+class CallbackSink(AlertSink):  # pylint: disable=too-few-public-methods
+    """
+    Passes alerts to a callback, e.g. to show them in the UI.
+    """
+
+    def __init__(self, callback: Callable[[Alert], None]):
+        """
+        Initializes the CallbackSink.
+
+        Args:
+            callback (Callable[[Alert], None]): Function called per alert
+        """
+        self._callback = callback
+
+    def send(self, alert: Alert) -> None:
+        self._callback(alert)
+
+
+class AlertEngine:
+    """
+    Evaluates rules on changes and delivers triggered alerts to the sinks.
+
+    Attributes:
+        _rules_by_field (Dict[str, List[Rule]]): Rules per field they depend on.
+        _sinks (List[AlertSink]): Receivers of triggered alerts.
+    """
+
+    def __init__(self, rules: Optional[List[Rule]] = None, sinks: Optional[List[AlertSink]] = None):
+        """
+        Initializes the AlertEngine.
+
+        Args:
+            rules (Optional[List[Rule]], optional): Initial rules. Defaults to None.
+            sinks (Optional[List[AlertSink]], optional): Initial sinks. Defaults to None.
+        """
+        self._rules_by_field: Dict[str, List[Rule]] = {}
+        self._sinks: List[AlertSink] = list(sinks or [])
+        for rule in rules or []:
+            self.add_rule(rule)
+
+    def add_rule(self, rule: Rule) -> None:
+        """
+        Adds a rule.
+
+        Args:
+            rule (Rule): Rule to add
+        """
+        for field in rule.fields:
+            self._rules_by_field.setdefault(field, []).append(rule)
+
+    def remove_rule(self, name: str) -> None:
+        """
+        Removes all rules with the given name.
+
+        Args:
+            name (str): Name of the rule
+        """
+        for field in list(self._rules_by_field):
+            self._rules_by_field[field] = [rule for rule in self._rules_by_field[field] if rule.name != name]
+            if not self._rules_by_field[field]:
+                del self._rules_by_field[field]
+
+    def add_sink(self, sink: AlertSink) -> None:
+        """
+        Adds a receiver of alerts.
+
+        Args:
+            sink (AlertSink): Sink to add
+        """
+        self._sinks.append(sink)
+
+    def on_changes(self, changes: List[Change]) -> List[Alert]:
+        """
+        Evaluates the rules depending on the changed fields and delivers triggered alerts.
+
+        Args:
+            changes (List[Change]): Changes of a write batch
+
+        Returns:
+            List[Alert]: Triggered alerts
+        """
+        alerts = []
+        for change in changes:
+            rules = {id(rule): rule for field in change.changed for rule in self._rules_by_field.get(field, ())}
+            for rule in rules.values():
+                if rule.triggered(change):
+                    alerts.append(Alert(rule, change))
+
+        for alert in alerts:
+            for sink in self._sinks:
+                try:
+                    sink.send(alert)
+                except Exception as e:  # pylint: disable=broad-exception-caught
+                    logger.error("Alert sink %s failed: %s", type(sink).__name__, str(e))
+        return alerts
@@ -0,0 +1,298 @@
+"""Requests of the configured API providers
+
+Build the requests of the API providers in the field mapping, request them with
+hedging and map the responses to DB fields or financial statement rows. The
+sync DbHandler and the AsyncDbHandler share this request and mapping layer.
+"""
+import json
+import logging
+import os
+from typing import Any, Dict, List, Optional, Tuple
+import requests
+from .request_hedging import LatencyTracker, ThreadPerCallExecutor, hedged_call
+from .statements import DEFAULT_PERIOD_TYPE, StatementRow
+
+logger = logging.getLogger(__name__)
+
+# Losing hedged requests keep running until they time out, so every request gets its own thread
+_REQUEST_EXECUTOR = ThreadPerCallExecutor()
+
+
+class ApiClient:
+    """
+    Request and mapping layer of the APIs configured in the field mapping.
+
+    Attributes:
+        latency (LatencyTracker): Latency statistics per API provider, used for hedged requests.
+        _field_mapping (Dict): API field mappings loaded from a JSON file.
+        _api_key (Optional[str]): API key for providers without their own "api_key_env".
+    """
+
+    def __init__(self, field_mapping: Dict, api_key: Optional[str], latency: Optional[LatencyTracker] = None):
+        """
+        Initializes the ApiClient.
+
+        Args:
+            field_mapping (Dict): API field mappings
+            api_key (Optional[str]): API key for providers without their own "api_key_env"
+            latency (Optional[LatencyTracker], optional): Latency statistics to use. Defaults to a new tracker.
+        """
+        self._field_mapping = field_mapping
+        self._api_key = api_key
+        self.latency = latency or LatencyTracker()
+
+    def api_names(self) -> List[str]:
+        """
+        Returns the names of all configured APIs.
+
+        Returns:
+            List[str]: Names of the APIs in the field mapping
+        """
+        return list(self._field_mapping)
+
+    def get_option(self, api_name: str, option: str, default: Any = None) -> Any:
+        """
+        Returns an option of an API entry, e.g. "batch_size" or "search_field".
+
+        Args:
+            api_name (str): Name of the API in the field mapping
+            option (str): Name of the option
+            default (Any, optional): Value if the option is not configured. Defaults to None.
+
+        Returns:
+            Any: Configured value or the default
+        """
+        return self._field_mapping[api_name].get(option, default)
+
+    def providers(self, api_name: str) -> List[Dict[str, Any]]:
+        """
+        Returns the providers configured for an API.
+
+        An API entry either describes a single provider directly, or holds a list of
+        alternative providers in "providers", which are mapped to the same DB fields.
+
+        Args:
+            api_name (str): Name of the API in the field mapping
+
+        Returns:
+            List[Dict[str, Any]]: Provider configurations in order of preference
+        """
+        return self._field_mapping[api_name].get("providers", [self._field_mapping[api_name]])
+
+    def is_statement(self, api_name: str) -> bool:
+        """
+        Checks if an API returns a financial statement with multiple periods.
+
+        Statement APIs are configured with "statement" (name of the statement) and
+        optionally "period_field" per provider (field holding the period, defaults to "date").
+        All returned periods are stored in the financial_statements table, see period_type().
+
+        Args:
+            api_name (str): Name of the API in the field mapping
+
+        Returns:
+            bool: True for statement APIs
+        """
+        return "statement" in self._field_mapping[api_name]
+
+    def period_type(self, api_name: str, provider_index: int = 0) -> str:
+        """
+        Returns the period type of a statement API, e.g. "annual" or "quarter".
+
+        The period type is the "period_type" of the provider, else the requested "period"
+        in its "default_params", else "annual".
+
+        Args:
+            api_name (str): Name of the statement API in the field mapping
+            provider_index (int, optional): Index of the provider. Defaults to 0.
+
+        Returns:
+            str: Period type of the returned statements
+        """
+        provider = self.providers(api_name)[provider_index]
+        return provider.get("period_type", provider["default_params"].get("period", DEFAULT_PERIOD_TYPE))
+
+    def statement_apis(self) -> List[str]:
+        """
+        Returns the names of all configured statement APIs.
+
+        Returns:
+            List[str]: Names of the statement APIs
+        """
+        return [api_name for api_name in self._field_mapping if self.is_statement(api_name)]
+
+    def provider_name(self, api_name: str, index: int) -> str:
+        """
+        Returns the name of a provider, used for latency tracking and logging.
+
+        Args:
+            api_name (str): Name of the API in the field mapping
+            index (int): Index of the provider in the provider group
+
+        Returns:
+            str: Configured provider name or "<api_name>#<index>"
+        """
+        return self.providers(api_name)[index].get("name", f"{api_name}#{index}")
+
+    def build_request(self, provider: Dict[str, Any], search_value: str) -> Tuple[str, Dict[str, Any]]:
+        """
+        Builds URL and parameters of a provider request.
+
+        Args:
+            provider (Dict[str, Any]): Provider configuration
+            search_value (str): Value to search for, e.g. ISIN or symbol
+
+        Returns:
+            Tuple[str, Dict[str, Any]]: Request URL and request parameters, without unset parameters
+        """
+        # setup request url and parameters, depending if the search parameter is a parameter or part of url
+        request_params = dict(provider["default_params"])
+        if provider["search_param"]:
+            request_url = provider["base_url"]
+            request_params[provider["search_param"]] = search_value
+        else:
+            request_url = provider["base_url"] + search_value
+
+        logger.debug("API Request: %s with params: %s", request_url, request_params)
+
+        api_key_env = provider.get("api_key_env")
+        request_params[provider.get("api_key_param", "apikey")] = \
+            os.getenv(api_key_env) if api_key_env else self._api_key
+        # requests drops None values, aiohttp rejects them
+        return request_url, {name: value for name, value in request_params.items() if value is not None}
+
+    def check_response(self, provider: Dict[str, Any], json_data: Any, request_url: str) -> Any:
+        """
+        Checks that a decoded response holds the entry to map.
+
+        Args:
+            provider (Dict[str, Any]): Provider configuration
+            json_data (Any): Decoded JSON response
+            request_url (str): Requested URL, used in the error message
+
+        Raises:
+            ValueError: Response does not contain the configured entry
+
+        Returns:
+            Any: The checked JSON response
+        """
+        try:
+            json_data[provider.get("first_entry", 0)]
+        except (KeyError, IndexError, TypeError) as e:
+            raise ValueError(f"No data in response of {request_url}") from e
+        return json_data
+
+    def request_provider(self, provider: Dict[str, Any], search_value: str) -> Any:
+        """
+        Requests a single provider and checks that the response holds an entry to map.
+
+        Args:
+            provider (Dict[str, Any]): Provider configuration
+            search_value (str): Value to search for, e.g. ISIN or symbol
+
+        Raises:
+            ValueError: Response does not contain the configured entry
+
+        Returns:
+            Any: Decoded JSON response
+        """
+        request_url, request_params = self.build_request(provider, search_value)
+        # a shorter per provider "timeout" lets losing hedged requests finish earlier
+        response = requests.get(request_url, params=request_params, timeout=provider.get("timeout", 30))
+        response.raise_for_status()
+        return self.check_response(provider, json.loads(response.content), request_url)
+
+    def hedge_targets(self, api_name: str) -> List[int]:
+        """
+        Returns the provider indexes of the alternative calls of a hedged request, in order of preference.
+
+        An API with a single provider has no alternative to hedge with, so a slow request
+        is hedged with a duplicate request to the same endpoint. Set "hedge_duplicate" to
+        false in the API entry to save the duplicate requests, e.g. for tight rate limits.
+
+        Args:
+            api_name (str): Name of the API in the field mapping
+
+        Returns:
+            List[int]: Index of the requested provider per call
+        """
+        provider_count = len(self.providers(api_name))
+        if provider_count == 1 and self._field_mapping[api_name].get("hedge_duplicate", True):
+            return [0, 0]
+        return list(range(provider_count))
+
+    def fetch(self, api_name: str, search_value: str) -> Tuple[int, Any]:
+        """
+        Requests data from the providers of an API with hedging.
+
+        Args:
+            api_name (str): Name of the API in the field mapping
+            search_value (str): Value to search for, e.g. ISIN or symbol
+
+        Returns:
+            Tuple[int, Any]: Index of the answering provider and its decoded JSON response
+        """
+        targets = self.hedge_targets(api_name)
+        providers = self.providers(api_name)
+        calls = [
+            (self.provider_name(api_name, index),
+             lambda provider=providers[index]: self.request_provider(provider, search_value))
+            for index in targets
+        ]
+        call_index, json_data = hedged_call(calls, self.latency, _REQUEST_EXECUTOR)
+        return targets[call_index], json_data
+
+    def map_to_db_fields(
+        self, api_name: str, json_data: Any, provider_index: int = 0, skip_missing: bool = False
+    ) -> Dict[str, Any]:
+        """
+        Maps an API response to DB fields using the mapping of the answering provider.
+
+        Args:
+            api_name (str): Name of the API in the field mapping
+            json_data (Any): Decoded JSON response
+            provider_index (int, optional): Index of the provider that returned the data. Defaults to 0.
+            skip_missing (bool, optional): Skip mapped fields missing in the response instead of
+                raising a KeyError. Defaults to False.
+
+        Returns:
+            Dict[str, Any]: DB field names and values
+        """
+        provider = self.providers(api_name)[provider_index]
+        entry = json_data[provider.get("first_entry", 0)]
+
+        # Check mapping config and try to assign response values to maped field
+        mapped_data = {}
+        for api_field in provider['mapping']:
+            if skip_missing and api_field not in entry:
+                continue
+            mapped_data[provider['mapping'][api_field]] = entry[api_field]
+        logger.debug("Mapped data of %s: %s", api_name, mapped_data)
+
+        return mapped_data
+
+    def map_to_statement_rows(
+        self, api_name: str, isin: str, json_data: Any, provider_index: int = 0
+    ) -> List[StatementRow]:
+        """
+        Maps all periods of a statement API response to rows of the financial_statements table.
+
+        Args:
+            api_name (str): Name of the statement API in the field mapping
+            isin (str): ISIN the statement belongs to
+            json_data (Any): Decoded JSON response, a list with one entry per period
+            provider_index (int, optional): Index of the provider that returned the data. Defaults to 0.
+
+        Returns:
+            List[StatementRow]: Rows of (isin, period, statement, period_type, field, value)
+        """
+        provider = self.providers(api_name)[provider_index]
+        statement = self._field_mapping[api_name]["statement"]
+        period_type = self.period_type(api_name, provider_index)
+        period_field = provider.get("period_field", "date")
+        return [
+            (isin, entry[period_field], statement, period_type, db_field, entry[api_field])
+            for entry in json_data
+            for api_field, db_field in provider["mapping"].items()
+            if entry.get(api_field) is not None
+        ]
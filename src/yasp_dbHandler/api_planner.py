@@ -0,0 +1,352 @@
+"""Cost based planning of API calls
+
+Select the cheapest set of API calls providing the requested DB columns of the
+stale stocks. Batched endpoints, which return many symbols per request, are
+preferred. The plan can be inspected before it is executed.
+"""
+import itertools
+import logging
+import math
+from typing import Any, Dict, FrozenSet, Iterable, List, Set, Tuple
+from .api_client import ApiClient
+
+logger = logging.getLogger(__name__)
+
+
+class PlannedCall:
+    """
+    Calls of one API for a group of stocks.
+
+    Attributes:
+        api_name (str): Name of the API in the field mapping.
+        isins (List[str]): Stocks to request.
+        fields (Set[str]): DB fields requested from this API.
+        batch_size (int): Number of stocks per request, 1 for unbatched APIs.
+    """
+
+    def __init__(self, api_name: str, batch_size: int):
+        """
+        Initializes the PlannedCall.
+
+        Args:
+            api_name (str): Name of the API in the field mapping
+            batch_size (int): Number of stocks per request, 1 for unbatched APIs
+        """
+        self.api_name = api_name
+        self.batch_size = batch_size
+        self.isins: List[str] = []
+        self.fields: Set[str] = set()
+
+    def request_count(self) -> int:
+        """
+        Returns the number of HTTP requests of this call.
+
+        Returns:
+            int: Number of requests
+        """
+        return math.ceil(len(self.isins) / self.batch_size)
+
+    def batches(self) -> List[List[str]]:
+        """
+        Splits the stocks into the batches requested together.
+
+        Returns:
+            List[List[str]]: ISINs per request
+        """
+        return [self.isins[start:start + self.batch_size] for start in range(0, len(self.isins), self.batch_size)]
+
+    def __str__(self) -> str:
+        return (f"{self.api_name}: {self.request_count()} requests for {len(self.isins)} stocks "
+                f"({', '.join(sorted(self.fields))})")
+
+
+class RefreshPlan:
+    """
+    Inspectable plan of API calls for a partial refresh.
+
+    Attributes:
+        calls (List[PlannedCall]): Planned calls per API.
+        unavailable (Set[str]): Requested columns no API provides.
+        fresh (int): Number of stocks needing no request.
+    """
+
+    def __init__(self, calls: List[PlannedCall], unavailable: Set[str], fresh: int):
+        """
+        Initializes the RefreshPlan.
+
+        Args:
+            calls (List[PlannedCall]): Planned calls per API
+            unavailable (Set[str]): Requested columns no API provides
+            fresh (int): Number of stocks needing no request
+        """
+        self.calls = calls
+        self.unavailable = unavailable
+        self.fresh = fresh
+
+    def call_count(self) -> int:
+        """
+        Returns the number of HTTP requests executing the plan costs.
+
+        Returns:
+            int: Number of requests
+        """
+        return sum(call.request_count() for call in self.calls)
+
+    def __str__(self) -> str:
+        lines = [f"{self.call_count()} requests, {self.fresh} stocks without request"]
+        lines += [f"  {call}" for call in self.calls]
+        if self.unavailable:
+            lines.append(f"  not provided by any API: {', '.join(sorted(self.unavailable))}")
+        return "\n".join(lines)
+
+
+class ApiCallPlanner:
+    """
+    Plans the cheapest API calls for the stale fields of stocks.
+
+    The cost of an API per stock is 1 / batch_size requests. For every distinct set
+    of stale fields, the cheapest combination of APIs covering it is selected.
+
+    Attributes:
+        _api_fields (Dict[str, FrozenSet[str]]): DB fields provided by each API.
+        _batch_sizes (Dict[str, int]): Number of stocks per request of each API.
+    """
+
+    def __init__(self, api_fields: Dict[str, Iterable[str]], batch_sizes: Dict[str, int]):
+        """
+        Initializes the ApiCallPlanner.
+
+        Args:
+            api_fields (Dict[str, Iterable[str]]): DB fields provided by each API
+            batch_sizes (Dict[str, int]): Number of stocks per request of each API, 1 if unbatched
+        """
+        self._api_fields = {api_name: frozenset(fields) for api_name, fields in api_fields.items()}
+        self._batch_sizes = batch_sizes
+
+    def fields_of(self, api_name: str) -> FrozenSet[str]:
+        """
+        Returns the DB fields provided by an API.
+
+        Args:
+            api_name (str): Name of the API in the field mapping
+
+        Returns:
+            FrozenSet[str]: DB fields, empty for APIs unknown to the planner
+        """
+        return self._api_fields.get(api_name, frozenset())
+
+    def _cost(self, api_names: Tuple[str, ...]) -> float:
+        """
+        Returns the requests per stock of a combination of APIs.
+
+        Args:
+            api_names (Tuple[str, ...]): Combination of APIs
+
+        Returns:
+            float: Requests per stock
+        """
+        return sum(1 / self._batch_sizes.get(api_name, 1) for api_name in api_names)
+
+    def _cheapest_cover(self, needed: FrozenSet[str]) -> Tuple[str, ...]:
+        """
+        Returns the cheapest combination of APIs providing all needed fields.
+
+        Args:
+            needed (FrozenSet[str]): Fields to provide, all provided by at least one API
+
+        Returns:
+            Tuple[str, ...]: Names of the selected APIs
+        """
+        candidates = [api_name for api_name, fields in self._api_fields.items() if fields & needed]
+        best: Tuple[str, ...] = tuple(candidates)
+        # only a handful of APIs are configured, so all combinations can be checked
+        for size in range(1, len(candidates) + 1):
+            for combination in itertools.combinations(candidates, size):
+                if self._cost(combination) < self._cost(best) and \
+                        needed <= frozenset().union(*(self._api_fields[api_name] for api_name in combination)):
+                    best = combination
+        return best
+
+    def plan(self, stale: Dict[str, Set[str]]) -> RefreshPlan:
+        """
+        Plans the API calls for the stale fields of each stock.
+
+        Args:
+            stale (Dict[str, Set[str]]): Stale DB fields per ISIN
+
+        Returns:
+            RefreshPlan: Planned calls
+        """
+        provided = frozenset().union(*self._api_fields.values())
+        unavailable: Set[str] = set()
+        covers: Dict[FrozenSet[str], Tuple[str, ...]] = {}
+        calls: Dict[str, PlannedCall] = {}
+        fresh = 0
+        for isin, fields in stale.items():
+            unavailable |= fields - provided
+            needed = frozenset(fields & provided)
+            if not needed:
+                fresh += 1
+                continue
+            if needed not in covers:
+                covers[needed] = self._cheapest_cover(needed)
+            for api_name in covers[needed]:
+                call = calls.setdefault(api_name, PlannedCall(api_name, self._batch_sizes.get(api_name, 1)))
+                call.isins.append(isin)
+                call.fields |= needed & self._api_fields[api_name]
+        return RefreshPlan(list(calls.values()), unavailable, fresh)
+
+
+class RefreshBatch:  # pylint: disable=too-few-public-methods
+    """
+    One request of a planned call.
+
+    Attributes:
+        api_name (str): Name of the API in the field mapping.
+        batched (bool): The API returns one entry per search value, identified by its "batch_key".
+        stocks (List[Tuple[str, str]]): ISIN and search value per requested stock, the search values are unique.
+    """
+
+    def __init__(self, api_name: str, batched: bool, stocks: List[Tuple[str, str]]):
+        """
+        Initializes the RefreshBatch.
+
+        Args:
+            api_name (str): Name of the API in the field mapping
+            batched (bool): The API returns one entry per search value
+            stocks (List[Tuple[str, str]]): ISIN and unique search value per requested stock
+        """
+        self.api_name = api_name
+        self.batched = batched
+        self.stocks = stocks
+
+    def search_value(self) -> str:
+        """
+        Returns the search value of the request.
+
+        Returns:
+            str: Comma separated search values of all stocks
+        """
+        return ",".join(value for _, value in self.stocks)
+
+
+class Refresher:
+    """
+    Plans partial refreshes and executes their requests. Reading and writing the
+    stocks table is left to the caller.
+
+    Attributes:
+        _api (ApiClient): Request and mapping layer of the configured APIs.
+        _planner (ApiCallPlanner): Planner for the configured APIs.
+    """
+
+    def __init__(self, api: ApiClient):
+        """
+        Initializes the Refresher and creates the planner from the field mapping.
+
+        An API provides the DB fields mapped by all of its providers. APIs with a
+        "batch_size" accept that many comma separated search values per request.
+
+        Args:
+            api (ApiClient): Request and mapping layer of the configured APIs
+        """
+        self._api = api
+        api_fields = {}
+        batch_sizes = {}
+        for api_name in api.api_names():
+            if api.is_statement(api_name):
+                continue
+            api_fields[api_name] = set.intersection(
+                *(set(provider["mapping"].values()) for provider in api.providers(api_name)))
+            batch_sizes[api_name] = api.get_option(api_name, "batch_size", 1)
+        self._planner = ApiCallPlanner(api_fields, batch_sizes)
+
+    def plan(self, columns: List[str], fetched: Dict[str, Set[str]]) -> RefreshPlan:
+        """
+        Plans the API calls for the columns not provided by a recently fetched API.
+
+        Args:
+            columns (List[str]): DB columns to refresh
+            fetched (Dict[str, Set[str]]): Recently fetched APIs per ISIN to refresh, in refresh order
+
+        Returns:
+            RefreshPlan: Planned calls
+        """
+        stale = {}
+        for isin, api_names in fetched.items():
+            fresh_fields = set().union(*(self._planner.fields_of(api_name) for api_name in api_names))
+            stale[isin] = set(columns) - fresh_fields
+        return self._planner.plan(stale)
+
+    def batches(self, plan: RefreshPlan, stocks: Dict[str, Dict[str, Any]]) -> List[RefreshBatch]:
+        """
+        Splits the calls of a plan into requests.
+
+        A batched response is matched to the stocks by their search value. Stocks sharing a
+        search value, e.g. dual listings with the same symbol, go to separate requests, so
+        none of them is dropped.
+
+        Args:
+            plan (RefreshPlan): Plan to execute
+            stocks (Dict[str, Dict[str, Any]]): Rows of the planned stocks per ISIN
+
+        Returns:
+            List[RefreshBatch]: Requests of all calls, stocks without search value are left out
+        """
+        batches = []
+        for call in plan.calls:
+            search_field = self._api.get_option(call.api_name, "search_field", "symbol")
+            # the n-th stock of a search value goes to the n-th layer, search values are unique per layer
+            layers: List[List[Tuple[str, str]]] = []
+            occurrences: Dict[str, int] = {}
+            for isin in call.isins:
+                value = stocks.get(isin, {}).get(search_field)
+                if not value:
+                    continue
+                layer = occurrences.get(value, 0)
+                occurrences[value] = layer + 1
+                if layer == len(layers):
+                    layers.append([])
+                layers[layer].append((isin, value))
+            batches += [RefreshBatch(call.api_name, call.batch_size > 1, layer[start:start + call.batch_size])
+                        for layer in layers for start in range(0, len(layer), call.batch_size)]
+        return batches
+
+    def split(self, batch: RefreshBatch, provider_index: int, json_data: Any) -> List[Tuple[str, str, int, Any]]:
+        """
+        Splits the response of a request per stock.
+
+        Args:
+            batch (RefreshBatch): Requested batch
+            provider_index (int): Index of the provider that returned the data
+            json_data (Any): Decoded JSON response
+
+        Returns:
+            List[Tuple[str, str, int, Any]]: ISIN, API name, provider index and payload to map
+                per answered stock
+        """
+        if not batch.batched:
+            return [(isin, batch.api_name, provider_index, json_data) for isin, _ in batch.stocks]
+        # batched responses hold one entry per requested search value
+        batch_key = self._api.providers(batch.api_name)[provider_index].get("batch_key", "symbol")
+        entries = {entry.get(batch_key): entry for entry in json_data}
+        return [(isin, batch.api_name, provider_index, [entries[value]])
+                for isin, value in batch.stocks if value in entries]
+
+    def request(self, batch: RefreshBatch) -> List[Tuple[str, str, int, Any]]:
+        """
+        Requests one batch and splits the response per stock.
+
+        Args:
+            batch (RefreshBatch): Batch to request
+
+        Returns:
+            List[Tuple[str, str, int, Any]]: ISIN, API name, provider index and payload to map
+                per answered stock, empty if the request failed
+        """
+        try:
+            provider_index, json_data = self._api.fetch(batch.api_name, batch.search_value())
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            logger.error("Refresh request %s for %s failed: %s", batch.api_name, batch.search_value(), str(e))
+            return []
+        return self.split(batch, provider_index, json_data)
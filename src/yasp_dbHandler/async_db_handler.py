@@ -0,0 +1,421 @@
+"""
+Asyncio interface of the stock database for embedding in async services.
+
+API requests use a pooled aiohttp session with semaphore bounded concurrency,
+all SQLite work runs in one dedicated writer thread owning the DbHandler.
+
+Usage:
+    async with await AsyncDbHandler.create("stocks.db") as db:
+        await db.add_isins(["DE0007164600", "US0378331005"])
+"""
+import asyncio
+import functools
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from .api_planner import RefreshBatch, RefreshPlan, Refresher
+from .db_handler import DbHandler
+from .request_hedging import async_hedged_call
+
+try:
+    import aiohttp
+except ImportError:  # pragma: no cover
+    aiohttp = None
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncDbHandler:
+    """
+    Async handler for the stock database. Create instances with AsyncDbHandler.create().
+
+    Attributes:
+        _db (DbHandler): Wrapped handler, only used in the writer thread for database access.
+        _api (ApiClient): Request and mapping layer of the wrapped handler, shares its latency statistics.
+        _refresher (Refresher): Splits the responses of refresh requests per stock.
+        _writer (ThreadPoolExecutor): Single thread executing all database operations.
+        _session (aiohttp.ClientSession): Pooled HTTP session for API requests.
+        _semaphore (asyncio.Semaphore): Bounds the number of API lookups in flight. A lookup may
+            fire a backup request per further provider, or a duplicate request for single provider
+            APIs, the HTTP connections are bounded by the connection limit of the session.
+    """
+
+    def __init__(self, db: DbHandler, writer: ThreadPoolExecutor, max_concurrency: int, connection_limit: int):
+        """
+        Initializes the AsyncDbHandler, use AsyncDbHandler.create() instead.
+
+        Args:
+            db (DbHandler): Handler created in the writer thread
+            writer (ThreadPoolExecutor): Single thread executor owning the database connection
+            max_concurrency (int): Maximum number of API lookups in flight
+            connection_limit (int): Maximum number of pooled HTTP connections
+        """
+        self._db = db
+        self._api = db.get_api_client()
+        self._refresher = Refresher(self._api)
+        self._writer = writer
+        self._session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=connection_limit))
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    @classmethod
+    async def create(
+        cls,
+        db_file: str,
+        db_config_file: str = "db_config.json",
+        mapping_config_file: str = "api_field_mapping.json",
+        max_concurrency: int = 50,
+        connection_limit: int = 20,
+        **kwargs: Any,
+    ) -> "AsyncDbHandler":
+        """
+        Creates an AsyncDbHandler. Loading the configuration and opening the database run in the writer thread.
+
+        Args:
+            db_file (str): Path to the SQLite database file.
+            db_config_file (str, optional): Path to the database configuration JSON file.
+                Defaults to "db_config.json".
+            mapping_config_file (str, optional): Path to the API field mapping JSON file.
+                Defaults to "api_field_mapping.json".
+            max_concurrency (int, optional): Maximum number of API lookups in flight, with hedging
+                each lookup may have a request per provider in flight. Defaults to 50.
+            connection_limit (int, optional): Maximum number of pooled HTTP connections. Defaults to 20.
+            **kwargs: Further arguments of DbHandler
+
+        Raises:
+            ImportError: aiohttp is not installed
+
+        Returns:
+            AsyncDbHandler: Initialized handler
+        """
+        if aiohttp is None:
+            raise ImportError("AsyncDbHandler requires aiohttp, install it with: pip install aiohttp")
+        writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="yasp-db-writer")
+        try:
+            db = await asyncio.get_running_loop().run_in_executor(
+                writer, functools.partial(DbHandler, db_file, db_config_file, mapping_config_file, **kwargs))
+        except Exception:
+            writer.shutdown(wait=False)
+            raise
+        return cls(db, writer, max_concurrency, connection_limit)
+
+    async def _run_db(self, function: Callable[..., Any], *args: Any) -> Any:
+        """
+        Executes a database operation in the writer thread.
+
+        Args:
+            function (Callable[..., Any]): Method of the wrapped DbHandler
+            *args: Arguments of the method
+
+        Returns:
+            Any: Result of the method
+        """
+        return await asyncio.get_running_loop().run_in_executor(self._writer, functools.partial(function, *args))
+
+    async def _request_provider(self, provider: Dict[str, Any], search_value: str) -> Any:
+        """
+        Requests a single provider and checks that the response holds an entry to map.
+
+        Args:
+            provider (Dict[str, Any]): Provider configuration
+            search_value (str): Value to search for, e.g. ISIN or symbol
+
+        Returns:
+            Any: Decoded JSON response
+        """
+        request_url, request_params = self._api.build_request(provider, search_value)
+        # a shorter per provider "timeout" lets losing hedged requests finish earlier
+        timeout = aiohttp.ClientTimeout(total=provider.get("timeout", 30))
+        async with self._session.get(request_url, params=request_params, timeout=timeout) as response:
+            response.raise_for_status()
+            content = await response.read()
+        return self._api.check_response(provider, json.loads(content), request_url)
+
+    async def _fetch_api_data(self, api_name: str, search_value: str) -> Tuple[int, Any]:
+        """
+        Requests data from the providers of an API with hedging.
+
+        Args:
+            api_name (str): Name of the API in the field mapping
+            search_value (str): Value to search for, e.g. ISIN or symbol
+
+        Returns:
+            Tuple[int, Any]: Index of the answering provider and its decoded JSON response
+        """
+        targets = self._api.hedge_targets(api_name)
+        providers = self._api.providers(api_name)
+        calls = [
+            (self._api.provider_name(api_name, index),
+             functools.partial(self._request_provider, providers[index], search_value))
+            for index in targets
+        ]
+        # acquired around the hedged call, so waiting for a slot neither counts as provider
+        # latency nor triggers backup requests. Backup requests share the slot of their lookup,
+        # so up to max_concurrency * len(targets) requests may be in flight, the pooled connections
+        # of the session stay bounded by connection_limit.
+        async with self._semaphore:
+            call_index, json_data = await async_hedged_call(calls, self._api.latency)
+        return targets[call_index], json_data
+
+    async def add_isin(self, isin: str) -> None:
+        """
+        Adds an ISIN entry with its symbol to the database.
+
+        Args:
+            isin (str): The International Securities Identification Number.
+        """
+        provider_index, json_data = await self._fetch_api_data("search_isin", isin)
+        await self._run_db(self._db.store_isin, isin, provider_index, json_data)
+
+    async def add_isins(self, isins: List[str]) -> List[Optional[Exception]]:
+        """
+        Adds many ISINs concurrently, bounded by the maximum number of lookups in flight.
+
+        Args:
+            isins (List[str]): The International Securities Identification Numbers.
+
+        Returns:
+            List[Optional[Exception]]: Per ISIN None on success, else the raised exception
+        """
+        return await asyncio.gather(*(self.add_isin(isin) for isin in isins), return_exceptions=True)
+
+    async def update_statements(
+        self, isin: str, api_names: Optional[List[str]] = None
+    ) -> Tuple[int, Dict[str, Exception]]:
+        """
+        Requests the financial statements of a stock concurrently and stores all returned periods.
+
+        Args:
+            isin (str): The International Securities Identification Number of the stock.
+            api_names (Optional[List[str]], optional): Statement APIs to request.
+                Defaults to all configured statement APIs.
+
+        Returns:
+            Tuple[int, Dict[str, Exception]]: Number of stored (period, field) values and
+                the error per failed API
+        """
+        symbol = await self._run_db(self._db.get_symbol, isin)
+        api_names = api_names or self._api.statement_apis()
+        results = await asyncio.gather(
+            *(self._fetch_api_data(api_name, symbol) for api_name in api_names), return_exceptions=True)
+        return await self._run_db(self._db.store_statements, isin, list(zip(api_names, results)))
+
+    async def update_entry(self, isin: str, api_data: Any, api_name: str) -> None:
+        """
+        Updates a single database entry specified by its ISIN using data from a specified API.
+
+        Args:
+            isin (str): The International Securities Identification Number of the entry to update.
+            api_data (Any): The decoded JSON response of the API, e.g. a list holding the values
+                at the configured "first_entry".
+            api_name (str): The name of the API providing the data, used to determine field mappings.
+        """
+        await self._run_db(self._db.update_entry, isin, api_data, api_name)
+
+    async def update_all(self, api_data_list: List[Dict[str, Any]], api_name: str) -> int:
+        """
+        Updates all database entries based on a list of API data, see DbHandler.update_all().
+
+        Args:
+            api_data_list (List[Dict[str, Any]]): A list of JSON data dictionaries received from the API.
+            api_name (str): The name of the API providing the data, used to determine field mappings.
+
+        Returns:
+            int: Number of updated entries
+        """
+        return await self._run_db(self._db.update_all, api_data_list, api_name)
+
+    async def update_watchlist(self, api_data_list: List[Dict[str, Any]], api_name: str) -> int:
+        """
+        Updates only the entries in the watchlist, see DbHandler.update_watchlist().
+
+        Args:
+            api_data_list (List[Dict[str, Any]]): A list of JSON data dictionaries received from the API.
+            api_name (str): The name of the API providing the data, used to determine field mappings.
+
+        Returns:
+            int: Number of updated entries
+        """
+        return await self._run_db(self._db.update_watchlist, api_data_list, api_name)
+
+    async def plan_refresh(
+        self, columns: List[str], isins: Optional[List[str]] = None, max_age_hours: Optional[float] = None
+    ) -> RefreshPlan:
+        """
+        Plans the cheapest API calls refreshing the requested columns, see DbHandler.plan_refresh().
+
+        Args:
+            columns (List[str]): DB columns to refresh, e.g. ["price"]
+            isins (Optional[List[str]], optional): Stocks to refresh. Defaults to all stocks.
+            max_age_hours (Optional[float], optional): Maximum age of fresh columns.
+                Defaults to None, refreshing all requested columns.
+
+        Returns:
+            RefreshPlan: Plan with the calls per API and the total number of requests
+        """
+        return await self._run_db(self._db.plan_refresh, columns, isins, max_age_hours)
+
+    async def _request_batch(self, batch: RefreshBatch) -> List[Tuple[str, str, int, Any]]:
+        """
+        Requests one batch of a refresh and splits the response per stock.
+
+        Args:
+            batch (RefreshBatch): Batch to request
+
+        Returns:
+            List[Tuple[str, str, int, Any]]: ISIN, API name, provider index and payload to map
+                per answered stock, empty if the request failed
+        """
+        try:
+            provider_index, json_data = await self._fetch_api_data(batch.api_name, batch.search_value())
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            logger.error("Refresh request %s for %s failed: %s", batch.api_name, batch.search_value(), str(e))
+            return []
+        return self._refresher.split(batch, provider_index, json_data)
+
+    async def execute_plan(self, plan: RefreshPlan) -> int:
+        """
+        Executes a refresh plan with concurrent requests and writes all results in one batch.
+
+        A failing request is logged and skipped, the other requests are executed.
+
+        Args:
+            plan (RefreshPlan): Plan created by plan_refresh()
+
+        Returns:
+            int: Number of executed requests
+        """
+        batches = await self._run_db(self._db.refresh_batches, plan)
+        results = await asyncio.gather(*(self._request_batch(batch) for batch in batches))
+        await self._run_db(self._db.store_refresh, [response for result in results for response in result])
+        return len(batches)
+
+    async def refresh(
+        self, columns: List[str], isins: Optional[List[str]] = None, max_age_hours: Optional[float] = None
+    ) -> RefreshPlan:
+        """
+        Refreshes the requested columns with the cheapest API calls, see DbHandler.refresh().
+
+        Args:
+            columns (List[str]): DB columns to refresh, e.g. ["price"]
+            isins (Optional[List[str]], optional): Stocks to refresh. Defaults to all stocks.
+            max_age_hours (Optional[float], optional): Maximum age of fresh columns.
+                Defaults to None, refreshing all requested columns.
+
+        Returns:
+            RefreshPlan: The executed plan
+        """
+        plan = await self.plan_refresh(columns, isins, max_age_hours)
+        logger.debug("Refresh plan: %s", plan)
+        await self.execute_plan(plan)
+        return plan
+
+    async def set_watchlist(self, isin: str, state: bool) -> None:
+        """
+        Adds or removes an entry from the watchlist based on the provided state.
+
+        Args:
+            isin (str): The International Securities Identification Number of the entry.
+            state (bool): True to add to the watchlist, False to remove.
+        """
+        await self._run_db(self._db.set_watchlist, isin, state)
+
+    async def remap(self, api_names: Optional[List[str]] = None) -> int:
+        """
+        Re-runs the current field mapping over the archived API responses, see DbHandler.remap().
+
+        Args:
+            api_names (Optional[List[str]], optional): APIs to remap. Defaults to all archived APIs.
+
+        Returns:
+            int: Number of stocks with updated fields in the stocks table
+        """
+        return await self._run_db(self._db.remap, api_names)
+
+    async def get_all(
+        self, filter_str: Optional[Dict[str, str]] = None, normalized: bool = False
+    ) -> List[Dict[str, Any]]:
+        """
+        Retrieves all entries from the database, see DbHandler.get_all().
+
+        Args:
+            filter_str (Optional[Dict[str, str]], optional): Column-value pairs to filter. Defaults to None.
+            normalized (bool, optional): Add monetary columns in base currency. Defaults to False.
+
+        Returns:
+            List[Dict[str, Any]]: A list of dictionaries representing the database entries.
+        """
+        return await self._run_db(self._db.get_all, filter_str, normalized)
+
+    async def get_watchlist(
+        self, filter_str: Optional[Dict[str, str]] = None, normalized: bool = False
+    ) -> List[Dict[str, Any]]:
+        """
+        Retrieves all entries in the watchlist, see DbHandler.get_watchlist().
+
+        Args:
+            filter_str (Optional[Dict[str, str]], optional): Column-value pairs to filter. Defaults to None.
+            normalized (bool, optional): Add monetary columns in base currency. Defaults to False.
+
+        Returns:
+            List[Dict[str, Any]]: A list of dictionaries representing the watchlist entries.
+        """
+        return await self._run_db(self._db.get_watchlist, filter_str, normalized)
+
+    async def get_entry(
+        self, isin: str, filter_str: Optional[Dict[str, str]] = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Retrieves a specific entry based on the provided ISIN, see DbHandler.get_entry().
+
+        Args:
+            isin (str): The International Securities Identification Number to search for.
+            filter_str (Optional[Dict[str, str]], optional): Additional column-value pairs to filter.
+                Defaults to None.
+
+        Returns:
+            Optional[Dict[str, Any]]: A dictionary representing the entry if found, else None.
+        """
+        return await self._run_db(self._db.get_entry, isin, filter_str)
+
+    async def get_statement(
+        self, isin: str, statement: str, fields: Optional[List[str]] = None, period_type: str = "annual"
+    ) -> List[Dict[str, Any]]:
+        """
+        Retrieves the stored periods of a financial statement, see DbHandler.get_statement().
+
+        Args:
+            isin (str): The International Securities Identification Number of the stock.
+            statement (str): Name of the statement, e.g. "income"
+            fields (Optional[List[str]], optional): Fields to retrieve. Defaults to all stored fields.
+            period_type (str, optional): Period type of the statement API, e.g. "quarter". Defaults to "annual".
+
+        Returns:
+            List[Dict[str, Any]]: One dictionary per period with "period" and the field values
+        """
+        return await self._run_db(self._db.get_statement, isin, statement, fields, period_type)
+
+    def get_api_latency(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Returns the latency statistics of all requested API providers.
+
+        Returns:
+            Dict[str, Dict[str, Any]]: Per provider sample count, failures, p50 and p95 latency in seconds
+        """
+        return self._db.get_api_latency()
+
+    async def close(self) -> None:
+        """
+        Closes the HTTP session and the database connection in the writer thread.
+        """
+        await self._session.close()
+        # the connection has to be closed by the thread that owns it
+        await self._run_db(self._db.close)
+        self._writer.shutdown(wait=True)
+        logger.info("AsyncDbHandler closed")
+
+    async def __aenter__(self) -> "AsyncDbHandler":
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        await self.close()
@@ -6,8 +6,14 @@ import os
 import sqlite3
 import json
 import logging
-from typing import Optional, Dict, Any, List
-import requests
+import zlib
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Dict, Any, Callable, List, Set, Tuple
+from .alerts import Change, diff_rows
+from .api_client import ApiClient
+from .api_planner import RefreshBatch, RefreshPlan, Refresher
+from . import fx_rates
+from . import statements
 
 
 # Configure logging
@@ -15,17 +21,52 @@ logging.basicConfig(level=logging.DEBUG,
                     format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Text columns the stock list sorts or filters by, all numeric columns are indexed as well
+INDEXED_TEXT_COLUMNS = ("symbol", "watchlist", "company", "sector", "subsector", "lastUpdate")
 
-class DbHandler:
+# Number of stocks remapped per transaction
+REMAP_CHUNK_SIZE = 500
+
+
+def build_filter_clause(filter_str: Optional[Dict[str, Any]], columns) -> Tuple[str, List[Any]]:
+    """
+    Builds a parameterized WHERE clause from column-value pairs.
+
+    Args:
+        filter_str (Optional[Dict[str, Any]]): Column-value pairs that all have to match
+        columns: Valid column names
+
+    Raises:
+        KeyError: Filter column is not a valid column
+
+    Returns:
+        Tuple[str, List[Any]]: WHERE clause (empty if no filter) and its parameters
+    """
+    if not filter_str:
+        return "", []
+    for column in filter_str:
+        if column not in columns:
+            raise KeyError(f"Unknown filter column: {column}")
+    clause = " WHERE " + " AND ".join(f"{column} = ?" for column in filter_str)
+    return clause, list(filter_str.values())
+
+
+class DbHandler:  # pylint: disable=too-many-instance-attributes,too-many-public-methods
     """
     A handler for managing database operations related to stock entries.
 
     Attributes:
-        _dbFile (str): Path to the SQLite database file.
         _apiKey (str): API key for external services.
         _dbConfig (Dict): Database configuration loaded from a JSON file.
         _fieldMapping (Dict): API field mappings loaded from a JSON file.
         _connection (sqlite3.Connection): SQLite database connection.
+        _db_file (str): Path to the SQLite database file.
+        _api (ApiClient): Request and mapping layer of the configured APIs, with hedged requests.
+        _change_listeners (List[Callable[[List[Change]], None]]): Receivers of changes to the stocks table.
+        _base_currency (str): Currency the stocks_normalized view converts monetary columns to.
+        _fx_ttl (timedelta): Age after which the cached FX rates are refreshed.
+        _fx_refresh (BackgroundRefresh): Refreshes outdated FX rates for normalized reads without blocking them.
+        _refresher (Refresher): Plans partial refreshes with the cheapest API calls and requests them.
     """
 
     def __init__(
@@ -33,6 +74,8 @@ class DbHandler:
         db_file: str,
         db_config_file: str = "db_config.json",
         mapping_config_file: str = "api_field_mapping.json",
+        base_currency: str = "EUR",
+        fx_ttl_hours: float = 24,
     ):
         """
         Initializes the DbHandler with database and API configurations.
@@ -43,10 +86,17 @@ class DbHandler:
                 Defaults to "db_config.json".
             mappingConfigFile (str, optional): Path to the API field mapping JSON file.
                 Defaults to "api_field_mapping.json".
+            base_currency (str, optional): Currency for normalized monetary columns. Defaults to "EUR".
+            fx_ttl_hours (float, optional): Hours the cached FX rates are valid. Defaults to 24.
         """
 
+        self._base_currency = base_currency
+        self._fx_ttl = timedelta(hours=fx_ttl_hours)
         self._db_config = self._load_config(db_config_file)
         self._field_mapping = self._load_config(mapping_config_file)
+        self._api_key = os.getenv("FMP_API")
+        self._api = ApiClient(self._field_mapping, self._api_key)
+        self._db_file = db_file
         self._connection = self._connect_db(db_file)
         try:
             self._check_config()
@@ -55,10 +105,12 @@ class DbHandler:
                          mapping_config_file, str(e))
             raise
         self._initialize_db()
+        self._refresher = Refresher(self._api)
+        self._fx_refresh = fx_rates.BackgroundRefresh(db_file, self._api_key, base_currency, self._fx_ttl)
         logger.info("DbHandler initialized with dbFile: %s", db_file)
-        self._api_key = os.getenv("FMP_API")
         if not self._api_key:
             raise EnvironmentError("Environment variable FMP_API for API Key not defined")
+        self._change_listeners: List[Callable[[List[Change]], None]] = []
 
     def _load_config(self, config_file: str) -> Dict:
         """
@@ -139,49 +191,109 @@ class DbHandler:
                 self._connection.execute(create_table_query)
                 logger.info("Table stocks initialized with fields: %s", field_definitions)
 
+        with self._connection:
+            self._connection.execute(
+                "create table if not exists api_payloads (isin TEXT, api_name TEXT, provider INTEGER, "
+                "fetched_at TEXT, payload BLOB, PRIMARY KEY (isin, api_name)) WITHOUT ROWID")
+            statements.create_tables(self._connection, {
+                self._field_mapping[api_name]["statement"]: self._api.period_type(api_name)
+                for api_name in self._api.statement_apis()})
+            fx_rates.create_tables(self._connection, self._db_config)
+            # Fixed set of indexes for sorting and filtering the stock list, an index implicitly ends
+            # with the row id, so keyset pages are range scans
+            for column, column_type in self._db_config.items():
+                if column in INDEXED_TEXT_COLUMNS or (
+                        column_type.split()[0] in ("REAL", "INTEGER") and "PRIMARY KEY" not in column_type):
+                    self._connection.execute(f"create index if not exists idx_stocks_{column} on stocks ({column})")
+
     def _check_config(self):
         """
         Check consistance of configurations from database config and field mapping
 
         Raises:
             Exception: If DB field, assigned to API return value is not in DB config
+            KeyError: If two statement APIs store the same statement with the same period type
         """
+        statement_apis: Dict[Tuple[str, str], str] = {}
         for api in self._field_mapping:
-            for api_field in self._field_mapping[api]['mapping']:
-                logger.debug(
-                    "Check Config: %s", self._field_mapping[api]['mapping'][api_field])
-                if self._field_mapping[api]['mapping'][api_field] not in self._db_config:
-                    logger.error(
-                        "No database field found for api mapping: %s - %s : %s",
-                        api, api_field, str(self._field_mapping[api]['mapping'][api_field]))
-                    raise KeyError(
-                        "Content of DB configuration and API Mapping inconsistnent")
-
-    def _map_api_data_to_db_fields(self, api_name: str, search_value: str) -> Dict[str, Any]:
-
-        # setup request url and parameters, depending if the search parameter is a parameter or part of url
-        if self._field_mapping[api_name]["search_param"]:
-            request_url = self._field_mapping[api_name]["base_url"]
-            request_params = self._field_mapping[api_name]["default_params"]
-            request_params[self._field_mapping[api_name]["search_param"]] = search_value
-        else:
-            request_url = self._field_mapping[api_name]["base_url"] + search_value
-            request_params = self._field_mapping[api_name]["default_params"]
+            if self._api.is_statement(api):
+                # statement fields are stored in the financial_statements table
+                for index in range(len(self._api.providers(api))):
+                    key = (self._field_mapping[api]["statement"], self._api.period_type(api, index))
+                    if statement_apis.setdefault(key, api) != api:
+                        logger.error("Statement %s with period type %s stored by %s and %s",
+                                     key[0], key[1], statement_apis[key], api)
+                        raise KeyError(f"Duplicate statement in API Mapping: {key[0]} ({key[1]})")
+                continue
+            for provider in self._api.providers(api):
+                for api_field in provider['mapping']:
+                    logger.debug(
+                        "Check Config: %s", provider['mapping'][api_field])
+                    if provider['mapping'][api_field] not in self._db_config:
+                        logger.error(
+                            "No database field found for api mapping: %s - %s : %s",
+                            api, api_field, str(provider['mapping'][api_field]))
+                        raise KeyError(
+                            "Content of DB configuration and API Mapping inconsistnent")
+
+    def get_api_latency(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Returns the latency statistics of all requested API providers.
+
+        Returns:
+            Dict[str, Dict[str, Any]]: Per provider sample count, failures, p50 and p95 latency in seconds
+        """
+        return self._api.latency.stats()
+
+    def get_api_client(self) -> ApiClient:
+        """
+        Returns the request and mapping layer of the configured APIs, e.g. to request them asynchronously.
+
+        Returns:
+            ApiClient: Client of the configured APIs, sharing the latency statistics of this handler
+        """
+        return self._api
+
+    def get_db_file(self) -> str:
+        """
+        Returns the path of the SQLite database file, e.g. to open additional reader connections.
 
-        logger.debug("API Request: %s with params: %s", request_url, request_params)
+        Returns:
+            str: Path to the SQLite database file
+        """
+        return self._db_file
 
-        request_params["apikey"] = self._api_key
-        response = requests.get(request_url, params=request_params, timeout=30).content
-        json_data = json.loads(response)
+    def get_columns(self) -> List[str]:
+        """
+        Returns the configured columns of the stocks table.
 
-        # Check mapping config and try to assign response values to maped field
-        mapped_data = {}
-        for api_field in self._field_mapping[api_name]['mapping']:
-            mapped_data[self._field_mapping[api_name]['mapping'][api_field]] = \
-                json_data[self._field_mapping[api_name]["first_entry"]][api_field]
-        print(mapped_data)
+        Returns:
+            List[str]: Column names from the database configuration
+        """
+        return list(self._db_config)
 
-        return mapped_data
+    def _select_stocks(
+        self, filter_str: Optional[Dict[str, Any]] = None, normalized: bool = False
+    ) -> List[Dict[str, Any]]:
+        """
+        Selects rows of the stocks table, matching all column-value pairs of the filter.
+
+        Args:
+            filter_str (Optional[Dict[str, Any]], optional): Column-value pairs to filter. Defaults to None.
+            normalized (bool, optional): Add monetary columns in base currency with the cached FX rates,
+                outdated rates are refreshed in the background. Defaults to False.
+
+        Returns:
+            List[Dict[str, Any]]: Matching rows, ordered by id
+        """
+        where, params = build_filter_clause(filter_str, self._db_config)
+        table_name = "stocks"
+        if normalized:
+            table_name = "stocks_normalized"
+            self._fx_refresh.start_if_outdated(self._connection)
+        cursor = self._connection.execute(f"SELECT * FROM {table_name}{where} ORDER BY id", params)
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
 
     def _insert_dict_into_table(self, table_name: str, data_dict: Dict[str, Any]) -> None:
         """
@@ -210,6 +322,12 @@ class DbHandler:
                 self._connection.commit()
 
                 logger.debug("Insert data to table: %s with query: %s, values: %s", table_name, sql_query, values)
+            if table_name == "stocks" and self._change_listeners:
+                row = self._select_rows_by_isin([data_dict["isin"]])[data_dict["isin"]]
+                self._notify_changes([Change(
+                    data_dict["isin"],
+                    {column: (None, row[column]) for column in data_dict if row[column] is not None},
+                    row)])
         except sqlite3.DatabaseError as e:
             logger.error("Database error: %s", str(e))
             raise
@@ -217,6 +335,189 @@ class DbHandler:
             logger.error("Error during DB insert operation: %s", str(e))
             raise
 
+    def _update_rows(self, table_name: str, rows: Dict[str, Dict[str, Any]]) -> None:
+        """
+        Updates rows identified by their ISIN in one transaction.
+
+        Rows updating the same set of columns are written with a single executemany.
+        Changed fields of the stocks table are passed to the change listeners.
+
+        Args:
+            table_name (str): Name of the table to update
+            rows (Dict[str, Dict[str, Any]]): Column-value pairs per ISIN
+        Raises:
+            DatabaseError: Exception during database handling
+        """
+        capture = table_name == "stocks" and bool(self._change_listeners)
+        batches: Dict[Tuple[str, ...], List[Tuple[Any, ...]]] = {}
+        for isin, data_dict in rows.items():
+            if data_dict:
+                batches.setdefault(tuple(data_dict), []).append((*data_dict.values(), isin))
+        try:
+            with self._connection:
+                old_rows = self._select_rows_by_isin(list(rows)) if capture else {}
+                for columns, values in batches.items():
+                    assignments = ', '.join(f"{column} = ?" for column in columns)
+                    sql_query = f"UPDATE {table_name} SET {assignments} WHERE isin = ?"
+                    self._connection.executemany(sql_query, values)
+                    logger.debug("Update %d rows of table: %s with query: %s", len(values), table_name, sql_query)
+                # compare the stored values, so the column affinity is applied to both sides,
+                # e.g. True is stored as '1' in a TEXT column
+                new_rows = self._select_rows_by_isin(list(old_rows)) if capture else {}
+        except sqlite3.DatabaseError as e:
+            logger.error("Database error: %s", str(e))
+            raise
+
+        self._notify_changes(diff_rows(rows, old_rows, new_rows))
+
+    def _select_rows_by_isin(self, isins: List[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        Selects complete rows of the stocks table by their ISIN.
+
+        Args:
+            isins (List[str]): ISINs of the rows
+
+        Returns:
+            Dict[str, Dict[str, Any]]: Rows per ISIN, missing ISINs are left out
+        """
+        rows = {}
+        # stay below the SQLite limit of host parameters per statement
+        for start in range(0, len(isins), 500):
+            chunk = isins[start:start + 500]
+            cursor = self._connection.execute(
+                f"SELECT * FROM stocks WHERE isin IN ({', '.join('?' for _ in chunk)})", chunk)
+            columns = [column[0] for column in cursor.description]
+            for row in cursor.fetchall():
+                row_dict = dict(zip(columns, row))
+                rows[row_dict["isin"]] = row_dict
+        return rows
+
+    def add_change_listener(self, listener: Callable[[List[Change]], None]) -> None:
+        """
+        Registers a receiver for changes to the stocks table, e.g. AlertEngine.on_changes.
+
+        The listener is called after each write batch with the changed rows and fields only.
+
+        Args:
+            listener (Callable[[List[Change]], None]): Function called with the changes of a write batch
+        """
+        self._change_listeners.append(listener)
+
+    def remove_change_listener(self, listener: Callable[[List[Change]], None]) -> None:
+        """
+        Unregisters a receiver of changes to the stocks table.
+
+        Args:
+            listener (Callable[[List[Change]], None]): Function registered with add_change_listener()
+        """
+        if listener in self._change_listeners:
+            self._change_listeners.remove(listener)
+
+    def _notify_changes(self, changes: List[Change]) -> None:
+        """
+        Passes the changes of a write batch to all listeners.
+
+        Args:
+            changes (List[Change]): Changed rows and fields
+        """
+        if not changes:
+            return
+        for listener in self._change_listeners:
+            try:
+                listener(changes)
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                logger.error("Change listener failed: %s", str(e))
+
+    def _archive_payload(self, isin: str, api_name: str, provider_index: int, json_data: Any) -> None:
+        """
+        Stores the compressed raw API response, replacing an older response of the same API.
+
+        Args:
+            isin (str): ISIN the response belongs to
+            api_name (str): Name of the API in the field mapping
+            provider_index (int): Index of the provider that returned the data
+            json_data (Any): Decoded JSON response
+        """
+        self._archive_payloads([(isin, api_name, provider_index, json_data)])
+
+    def _archive_payloads(self, responses: List[Tuple[str, str, int, Any]]) -> None:
+        """
+        Stores many compressed raw API responses in one transaction.
+
+        Args:
+            responses (List[Tuple[str, str, int, Any]]): ISIN, API name, provider index and
+                decoded JSON response per response
+        """
+        fetched_at = datetime.now(timezone.utc).isoformat()
+        with self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO api_payloads (isin, api_name, provider, fetched_at, payload) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(isin, api_name, provider_index, fetched_at, zlib.compress(json.dumps(json_data).encode("utf-8")))
+                 for isin, api_name, provider_index, json_data in responses])
+
+    def remap(self, api_names: Optional[List[str]] = None) -> int:
+        """
+        Re-runs the current field mapping over the archived API responses and updates the stocks table.
+
+        This fills columns that were added to the mapping after the data was requested,
+        without requesting the APIs again.
+
+        Args:
+            api_names (Optional[List[str]], optional): APIs to remap. Defaults to all archived APIs.
+
+        Returns:
+            int: Number of stocks with updated fields in the stocks table
+        """
+        api_filter = ""
+        if api_names:
+            api_filter = f" AND api_name IN ({', '.join('?' for _ in api_names)})"
+        updated = 0
+        last_isin = ""
+        # the archive is read and written in chunks of stocks, so it is never loaded into memory at once
+        while True:
+            isins = [row[0] for row in self._connection.execute(
+                f"SELECT DISTINCT isin FROM api_payloads WHERE isin > ?{api_filter} ORDER BY isin LIMIT ?",
+                [last_isin, *(api_names or []), REMAP_CHUNK_SIZE])]
+            if not isins:
+                break
+            last_isin = isins[-1]
+            updated += self._remap_chunk(isins, api_filter, api_names or [])
+        logger.info("Remapped archived payloads of %d stocks", updated)
+        return updated
+
+    def _remap_chunk(self, isins: List[str], api_filter: str, api_names: List[str]) -> int:
+        """
+        Re-runs the current field mapping over the archived API responses of some stocks.
+
+        Args:
+            isins (List[str]): ISINs of the stocks
+            api_filter (str): Condition on the API names, empty for all APIs
+            api_names (List[str]): Parameters of the API name condition
+
+        Returns:
+            int: Number of stocks with updated fields in the stocks table
+        """
+        rows: Dict[str, Dict[str, Any]] = {}
+        statement_rows: List[statements.StatementRow] = []
+        for isin, api_name, provider_index, payload in self._connection.execute(
+                "SELECT isin, api_name, provider, payload FROM api_payloads "
+                f"WHERE isin IN ({', '.join('?' for _ in isins)}){api_filter} ORDER BY isin, fetched_at",
+                [*isins, *api_names]):
+            if api_name not in self._field_mapping or provider_index >= len(self._api.providers(api_name)):
+                logger.warning("Skip archived payload of %s for %s: API not configured", api_name, isin)
+                continue
+            json_data = json.loads(zlib.decompress(payload))
+            if self._api.is_statement(api_name):
+                statement_rows += self._api.map_to_statement_rows(api_name, isin, json_data, provider_index)
+            else:
+                rows.setdefault(isin, {}).update(
+                    self._api.map_to_db_fields(api_name, json_data, provider_index, skip_missing=True))
+
+        self._update_rows("stocks", rows)
+        statements.insert_rows(self._connection, statement_rows)
+        return len(rows)
+
     def add_isin(self, isin: str) -> None:
         """
         Adds an ISIN entry with its symbol to the database.
@@ -226,32 +527,269 @@ class DbHandler:
             symbol (str): The stock symbol associated with the ISIN.
         """
         # stock_data = {"isin": "DE0007164600", "company": "SAP", "symbol": "SAP"}
-        stock_data = self._map_api_data_to_db_fields("search_isin", isin)
+        provider_index, json_data = self._api.fetch("search_isin", isin)
+        self.store_isin(isin, provider_index, json_data)
+
+    def store_isin(self, isin: str, provider_index: int, json_data: Any) -> None:
+        """
+        Maps the ISIN search response and inserts the new stock.
+
+        Args:
+            isin (str): The International Securities Identification Number.
+            provider_index (int): Index of the provider that returned the data
+            json_data (Any): Decoded JSON response of the ISIN search
+        """
+        stock_data = self._api.map_to_db_fields("search_isin", json_data, provider_index)
         self._insert_dict_into_table("stocks", stock_data)
+        self._archive_payload(isin, "search_isin", provider_index, json_data)
+
+    def update_statements(
+        self, isin: str, api_names: Optional[List[str]] = None
+    ) -> Tuple[int, Dict[str, Exception]]:
+        """
+        Requests the financial statements of a stock and stores all returned periods.
+
+        One request per statement API returns all periods, e.g. the last 10 years. A
+        failing API does not discard the statements of the other APIs.
+
+        Args:
+            isin (str): The International Securities Identification Number of the stock.
+            api_names (Optional[List[str]], optional): Statement APIs to request.
+                Defaults to all configured statement APIs.
+
+        Raises:
+            KeyError: ISIN not in the database
+
+        Returns:
+            Tuple[int, Dict[str, Exception]]: Number of stored (period, field) values and
+                the error per failed API
+        """
+        symbol = self.get_symbol(isin)
+        responses: List[Tuple[str, Any]] = []
+        for api_name in api_names or self._api.statement_apis():
+            try:
+                responses.append((api_name, self._api.fetch(api_name, symbol)))
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                responses.append((api_name, e))
+        return self.store_statements(isin, responses)
+
+    def get_symbol(self, isin: str) -> str:
+        """
+        Returns the symbol of a stock, used to request the symbol based APIs.
+
+        Args:
+            isin (str): The International Securities Identification Number of the stock.
+
+        Raises:
+            KeyError: ISIN not in the database
+
+        Returns:
+            str: Symbol of the stock
+        """
+        entry = self.get_entry(isin)
+        if entry is None:
+            raise KeyError(f"ISIN not in database: {isin}")
+        return entry["symbol"]
+
+    def store_statements(self, isin: str, responses: List[Tuple[str, Any]]) -> Tuple[int, Dict[str, Exception]]:
+        """
+        Maps statement responses of a stock and stores all periods of the successful APIs.
+
+        Args:
+            isin (str): The International Securities Identification Number of the stock.
+            responses (List[Tuple[str, Any]]): API name and either (provider index, decoded JSON response)
+                or the error of the request per statement API
+
+        Returns:
+            Tuple[int, Dict[str, Exception]]: Number of stored (period, field) values and
+                the error per failed API
+        """
+        rows: List[statements.StatementRow] = []
+        failures: Dict[str, Exception] = {}
+        for api_name, result in responses:
+            try:
+                if isinstance(result, Exception):
+                    raise result
+                provider_index, json_data = result
+                rows += self._api.map_to_statement_rows(api_name, isin, json_data, provider_index)
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                logger.error("Statement API %s failed for %s: %s", api_name, isin, str(e))
+                failures[api_name] = e
+                continue
+            self._archive_payload(isin, api_name, provider_index, json_data)
+        statements.insert_rows(self._connection, rows)
+        return len(rows), failures
+
+    def get_statement(
+        self, isin: str, statement: str, fields: Optional[List[str]] = None, period_type: str = "annual"
+    ) -> List[Dict[str, Any]]:
+        """
+        Retrieves the stored periods of a financial statement.
+
+        Args:
+            isin (str): The International Securities Identification Number of the stock.
+            statement (str): Name of the statement, e.g. "income"
+            fields (Optional[List[str]], optional): Fields to retrieve. Defaults to all stored fields.
+            period_type (str, optional): Period type of the statement API, e.g. "quarter". Defaults to "annual".
+
+        Returns:
+            List[Dict[str, Any]]: One dictionary per period with "period" and the field values,
+                ordered by period
+        """
+        return statements.select_periods(self._connection, isin, statement, fields, period_type)
+
+    def refresh_fx_rates(self, force: bool = False) -> bool:
+        """
+        Refreshes the cached FX rates with one bulk request, if they are older than the TTL.
+
+        Args:
+            force (bool, optional): Refresh even if the cached rates are still valid. Defaults to False.
+
+        Returns:
+            bool: True if the rates were refreshed, False if the cached rates are still valid or the
+                response converts none of the stock currencies
+        """
+        if not force and fx_rates.rates_valid(self._connection, self._base_currency, self._fx_ttl):
+            return False
+        return fx_rates.store_rates(self._connection, fx_rates.request_quotes(self._api_key), self._base_currency)
+
+    def plan_refresh(
+        self, columns: List[str], isins: Optional[List[str]] = None, max_age_hours: Optional[float] = None
+    ) -> RefreshPlan:
+        """
+        Plans the cheapest API calls refreshing the requested columns, without executing them.
+
+        A column of a stock is fresh if an API providing it was requested for the stock
+        within max_age_hours. For the stale columns the cheapest combination of APIs is
+        selected, preferring batched endpoints.
+
+        Args:
+            columns (List[str]): DB columns to refresh, e.g. ["price"]
+            isins (Optional[List[str]], optional): Stocks to refresh. Defaults to all stocks.
+            max_age_hours (Optional[float], optional): Maximum age of fresh columns.
+                Defaults to None, refreshing all requested columns.
+
+        Raises:
+            KeyError: Unknown column
+
+        Returns:
+            RefreshPlan: Plan with the calls per API and the total number of requests
+        """
+        for column in columns:
+            if column not in self._db_config:
+                raise KeyError(f"Unknown column: {column}")
+        if isins is None:
+            isins = [row[0] for row in self._connection.execute("SELECT isin FROM stocks ORDER BY id")]
+
+        fetched: Dict[str, Set[str]] = {isin: set() for isin in isins}
+        if max_age_hours is not None:
+            cutoff = (datetime.now(timezone.utc) - timedelta(hours=max_age_hours)).isoformat()
+            for isin, api_name in self._connection.execute(
+                    "SELECT isin, api_name FROM api_payloads WHERE fetched_at >= ?", (cutoff,)):
+                if isin in fetched:
+                    fetched[isin].add(api_name)
+        return self._refresher.plan(columns, fetched)
+
+    def execute_plan(self, plan: RefreshPlan) -> int:
+        """
+        Executes a refresh plan and writes all results in one batch.
 
-    def get_all(self, filter_str: Optional[Dict[str, str]] = None) -> List[Dict[str, Any]]:
+        A failing request is logged and skipped, the other requests are executed.
+
+        Args:
+            plan (RefreshPlan): Plan created by plan_refresh()
+
+        Returns:
+            int: Number of executed requests
+        """
+        batches = self.refresh_batches(plan)
+        self.store_refresh([response for batch in batches for response in self._refresher.request(batch)])
+        return len(batches)
+
+    def refresh_batches(self, plan: RefreshPlan) -> List[RefreshBatch]:
+        """
+        Splits the calls of a refresh plan into requests, see Refresher.batches().
+
+        Args:
+            plan (RefreshPlan): Plan created by plan_refresh()
+
+        Returns:
+            List[RefreshBatch]: Requests of the plan
+        """
+        return self._refresher.batches(
+            plan, self._select_rows_by_isin(sorted({isin for call in plan.calls for isin in call.isins})))
+
+    def store_refresh(self, responses: List[Tuple[str, str, int, Any]]) -> None:
+        """
+        Maps the responses of refresh requests and writes them in one batch.
+
+        Args:
+            responses (List[Tuple[str, str, int, Any]]): ISIN, API name, provider index and
+                payload per answered stock, see Refresher.split()
+        """
+        now = datetime.now(timezone.utc).isoformat()
+        rows: Dict[str, Dict[str, Any]] = {}
+        for isin, api_name, provider_index, payload in responses:
+            rows.setdefault(isin, {}).update(
+                self._api.map_to_db_fields(api_name, payload, provider_index, skip_missing=True))
+            rows[isin]["lastUpdate"] = now
+        self._update_rows("stocks", rows)
+        self._archive_payloads(responses)
+        logger.info("Refreshed %d stocks", len(rows))
+
+    def refresh(
+        self, columns: List[str], isins: Optional[List[str]] = None, max_age_hours: Optional[float] = None
+    ) -> RefreshPlan:
+        """
+        Refreshes the requested columns with the cheapest API calls, see plan_refresh().
+
+        Args:
+            columns (List[str]): DB columns to refresh, e.g. ["price"]
+            isins (Optional[List[str]], optional): Stocks to refresh. Defaults to all stocks.
+            max_age_hours (Optional[float], optional): Maximum age of fresh columns.
+                Defaults to None, refreshing all requested columns.
+
+        Returns:
+            RefreshPlan: The executed plan
+        """
+        plan = self.plan_refresh(columns, isins, max_age_hours)
+        logger.debug("Refresh plan: %s", plan)
+        self.execute_plan(plan)
+        return plan
+
+    def get_all(
+        self, filter_str: Optional[Dict[str, str]] = None, normalized: bool = False
+    ) -> List[Dict[str, Any]]:
         """
         Retrieves all entries from the database, optionally applying filters.
 
         Args:
             filter (Optional[Dict[str, str]], optional): A dictionary of column-value pairs to filter the results.
                 Defaults to None.
+            normalized (bool, optional): Add fx_rate and monetary columns converted to the base currency
+                ("<column>_base"), FX rates older than the TTL are refreshed in the background. Defaults to False.
 
         Returns:
             List[Dict[str, Any]]: A list of dictionaries representing the database entries.
         """
+        return self._select_stocks(filter_str, normalized)
 
-    def get_watchlist(self, filter_str: Optional[Dict[str, str]] = None) -> List[Dict[str, Any]]:
+    def get_watchlist(
+        self, filter_str: Optional[Dict[str, str]] = None, normalized: bool = False
+    ) -> List[Dict[str, Any]]:
         """
         Retrieves all entries that are currently in the watchlist, optionally applying filters.
 
         Args:
             filter (Optional[Dict[str, str]], optional): A dictionary of column-value pairs to filter the
                 watchlist entries. Defaults to None.
+            normalized (bool, optional): Add fx_rate and monetary columns converted to the base currency
+                ("<column>_base"), FX rates older than the TTL are refreshed in the background. Defaults to False.
 
         Returns:
             List[Dict[str, Any]]: A list of dictionaries representing the watchlist entries.
         """
+        return self._select_stocks({**(filter_str or {}), "watchlist": True}, normalized)
 
     def get_entry(
         self, isin: str, filter_str: Optional[Dict[str, str]] = None
@@ -267,40 +805,83 @@ class DbHandler:
         Returns:
             Optional[Dict[str, Any]]: A dictionary representing the entry if found, else None.
         """
+        entries = self._select_stocks({**(filter_str or {}), "isin": isin})
+        return entries[0] if entries else None
 
     def update_entry(
-        self, isin: str, api_data: Dict[str, Any], api_name: str
+        self, isin: str, api_data: Any, api_name: str
     ) -> None:
         """
         Updates a single database entry specified by its ISIN using data from a specified API.
 
         Args:
             isin (str): The International Securities Identification Number of the entry to update.
-            api_data (Dict[str, Any]): The JSON data received from the API.
+            api_data (Any): The decoded JSON response of the API, e.g. a list holding the values
+                at the configured "first_entry".
             api_name (str): The name of the API providing the data, used to determine field mappings.
         """
+        stock_data = self._api.map_to_db_fields(api_name, api_data)
+        stock_data["lastUpdate"] = datetime.now(timezone.utc).isoformat()
+        self._update_rows("stocks", {isin: stock_data})
+        self._archive_payload(isin, api_name, 0, api_data)
 
     def update_all(
         self, api_data_list: List[Dict[str, Any]], api_name: str
-    ) -> None:
+    ) -> int:
         """
         Updates all database entries based on a list of API data from a specified API.
 
+        The entries are matched to the stocks by their "batch_key" (defaults to "symbol") and
+        the "search_field" of the stocks (defaults to "symbol"), e.g. a batched quote response.
+        To request and store the data in one step use refresh().
+
         Args:
             api_data_list (List[Dict[str, Any]]): A list of JSON data dictionaries received from the API.
             api_name (str): The name of the API providing the data, used to determine field mappings.
+
+        Returns:
+            int: Number of updated entries
         """
+        return self._update_from_list(api_data_list, api_name)
 
     def update_watchlist(
         self, api_data_list: List[Dict[str, Any]], api_name: str
-    ) -> None:
+    ) -> int:
         """
-        Updates only the entries in the watchlist using data from a specified API.
+        Updates only the entries in the watchlist using data from a specified API, see update_all().
 
         Args:
             api_data_list (List[Dict[str, Any]]): A list of JSON data dictionaries received from the API.
             api_name (str): The name of the API providing the data, used to determine field mappings.
+
+        Returns:
+            int: Number of updated entries
         """
+        return self._update_from_list(api_data_list, api_name, {"watchlist": True})
+
+    def _update_from_list(
+        self, api_data_list: List[Dict[str, Any]], api_name: str, filter_str: Optional[Dict[str, Any]] = None
+    ) -> int:
+        """
+        Matches the entries of an API response list to the stocks and writes them in one batch.
+
+        Args:
+            api_data_list (List[Dict[str, Any]]): A list of JSON data dictionaries received from the API.
+            api_name (str): The name of the API providing the data, used to determine field mappings.
+            filter_str (Optional[Dict[str, Any]], optional): Column-value pairs the updated stocks
+                have to match. Defaults to None.
+
+        Returns:
+            int: Number of updated entries
+        """
+        batch_key = self._api.providers(api_name)[0].get("batch_key", "symbol")
+        search_field = self._api.get_option(api_name, "search_field", "symbol")
+        entries = {entry.get(batch_key): entry for entry in api_data_list}
+        # several stocks may share a search value, e.g. dual listings with the same symbol
+        responses = [(row["isin"], api_name, 0, [entries[row[search_field]]])
+                     for row in self._select_stocks(filter_str) if row[search_field] in entries]
+        self.store_refresh(responses)
+        return len(responses)
 
     def set_watchlist(self, isin: str, state: bool) -> None:
         """
@@ -310,16 +891,19 @@ class DbHandler:
             isin (str): The International Securities Identification Number of the entry.
             state (bool): True to add to the watchlist, False to remove.
         """
-        with self._connection:
-            self._connection.execute(
-                "UPDATE entries SET watchlist = ? WHERE isin = ?",
-                (state, isin),
-            )
+        self._update_rows("stocks", {isin: {"watchlist": state}})
 
-    def __del__(self):
+    def close(self) -> None:
         """
-        Ensures the database connection is closed when the DbHandler instance is deleted.
+        Closes the database connection. Has to be called by the thread that created the DbHandler.
         """
-        if self._connection:
+        if getattr(self, "_connection", None):
             self._connection.close()
+            self._connection = None
             logger.info("Database connection closed")
+
+    def __del__(self):
+        """
+        Ensures the database connection is closed when the DbHandler instance is deleted.
+        """
+        self.close()
@@ -0,0 +1,274 @@
+"""Currency conversion rates
+
+Convert the FX quotes of a single bulk request into conversion rates of every
+quoted currency to a base currency and cache them in the fx_rates table. Reads
+never wait for the network, outdated rates are refreshed in the background.
+"""
+import json
+import logging
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+import requests
+
+logger = logging.getLogger(__name__)
+
+# URL returning the quotes of all currency pairs in one request
+FX_URL = "https://financialmodelingprep.com/api/v3/fx"
+
+# Monetary columns of the stocks table provided in base currency by the stocks_normalized view
+NORMALIZED_COLUMNS = ("price", "marketCap")
+
+# Quotes in sub units of a currency, e.g. London stocks quoted in pence
+SUB_UNITS = {
+    "GBp": ("GBP", 0.01),
+    "GBX": ("GBP", 0.01),
+    "ZAc": ("ZAR", 0.01),
+    "ILA": ("ILS", 0.01),
+}
+
+
+def create_tables(connection: sqlite3.Connection, columns: Dict[str, str]) -> None:
+    """
+    Creates the fx_rates table and (re)creates the stocks_normalized view over the stocks table.
+
+    Args:
+        connection (sqlite3.Connection): Database connection
+        columns (Dict[str, str]): Column definitions of the stocks table
+    """
+    connection.execute(
+        "create table if not exists fx_rates (currency TEXT PRIMARY KEY, base TEXT, rate REAL, "
+        "fetched_at TEXT) WITHOUT ROWID")
+    # Monetary columns in base currency with a single join, so screening and sorting
+    # across markets runs in the database
+    connection.execute("drop view if exists stocks_normalized")
+    if "currency" in columns:
+        normalized = "".join(f", s.{column} * fx.rate AS {column}_base"
+                             for column in NORMALIZED_COLUMNS if column in columns)
+        connection.execute(
+            f"create view stocks_normalized as select s.*, fx.rate AS fx_rate{normalized} "
+            "from stocks s left join fx_rates fx on fx.currency = s.currency")
+
+
+def rates_to_base(quotes: List[Dict[str, Any]], base_currency: str) -> Dict[str, float]:
+    """
+    Calculates the rate of each currency to the base currency.
+
+    Currencies not quoted against the base currency are converted via the quoted
+    pairs, e.g. JPY to EUR via JPY/USD and EUR/USD.
+
+    Args:
+        quotes (List[Dict[str, Any]]): Quotes with "ticker" (e.g. "EUR/USD"), "bid" and "ask"
+        base_currency (str): Currency to convert to
+
+    Returns:
+        Dict[str, float]: Value of one unit of each currency in base currency
+    """
+    pairs = []
+    for quote in quotes:
+        try:
+            first, second = quote["ticker"].split("/")
+            mid = (float(quote["bid"]) + float(quote["ask"])) / 2
+        except (KeyError, TypeError, ValueError):
+            continue
+        if mid > 0:
+            pairs.append((first, second, mid))
+
+    rates = {base_currency: 1.0}
+    found = True
+    while found:
+        found = False
+        for first, second, mid in pairs:
+            # 1 first = mid second
+            if second in rates and first not in rates:
+                rates[first] = mid * rates[second]
+                found = True
+            elif first in rates and second not in rates:
+                rates[second] = rates[first] / mid
+                found = True
+
+    for sub_unit, (currency, factor) in SUB_UNITS.items():
+        if currency in rates:
+            rates[sub_unit] = rates[currency] * factor
+    return rates
+
+
+def rates_valid(connection: sqlite3.Connection, base_currency: str, ttl: timedelta) -> bool:
+    """
+    Checks if the cached rates of the fx_rates table are younger than the TTL.
+
+    Args:
+        connection (sqlite3.Connection): Database connection
+        base_currency (str): Currency the cached rates have to convert to
+        ttl (timedelta): Age after which the rates are outdated
+
+    Returns:
+        bool: True if the cached rates can be used
+    """
+    fetched_at, base = connection.execute("SELECT MAX(fetched_at), MIN(base) FROM fx_rates").fetchone()
+    if not fetched_at or base != base_currency \
+            or datetime.now(timezone.utc) - datetime.fromisoformat(fetched_at) >= ttl:
+        return False
+    logger.debug("FX rates from %s still valid", fetched_at)
+    return True
+
+
+def request_quotes(api_key: Optional[str]) -> Any:
+    """
+    Requests the quotes of all currency pairs with one bulk request.
+
+    Args:
+        api_key (Optional[str]): API key of the FX provider
+
+    Returns:
+        Any: Decoded bulk FX response
+    """
+    response = requests.get(FX_URL, params={"apikey": api_key}, timeout=30)
+    response.raise_for_status()
+    return json.loads(response.content)
+
+
+def store_rates(connection: sqlite3.Connection, quotes: List[Dict[str, Any]], base_currency: str) -> bool:
+    """
+    Updates the cached rates of the fx_rates table with the rates of a bulk FX response.
+
+    An empty or garbled response must not replace the cached rates, so they are kept if
+    the response converts none of the currencies of the stocks table. Cached rates of
+    currencies missing in a partial response are kept as well.
+
+    Args:
+        connection (sqlite3.Connection): Database connection
+        quotes (List[Dict[str, Any]]): Decoded bulk FX response
+        base_currency (str): Currency to convert to
+
+    Returns:
+        bool: True if the rates were updated
+    """
+    rates = rates_to_base(quotes, base_currency)
+    needed = {row[0] for row in connection.execute(
+        "SELECT DISTINCT currency FROM stocks WHERE currency IS NOT NULL")} - {base_currency}
+    if len(rates) == 1 or (needed and not needed & set(rates)):
+        logger.warning("FX response converts none of the currencies %s, keep cached rates",
+                       ", ".join(sorted(needed)) or base_currency)
+        return False
+    if needed - set(rates):
+        logger.warning("FX response misses the currencies %s, keep their cached rates",
+                       ", ".join(sorted(needed - set(rates))))
+    fetched_at = datetime.now(timezone.utc).isoformat()
+    with connection:
+        # rates to another base currency cannot be mixed with the new ones
+        connection.execute("DELETE FROM fx_rates WHERE base != ?", (base_currency,))
+        connection.executemany(
+            "INSERT OR REPLACE INTO fx_rates (currency, base, rate, fetched_at) VALUES (?, ?, ?, ?)",
+            [(currency, base_currency, rate, fetched_at) for currency, rate in rates.items()])
+    logger.info("Refreshed %d FX rates to %s", len(rates), base_currency)
+    return True
+
+
+class BackgroundRefresh:  # pylint: disable=too-many-instance-attributes
+    """
+    Refreshes outdated FX rates in a background thread with its own database connection.
+
+    Only one refresh runs at a time. After a failed or unusable refresh no refresh is
+    started for a backoff time, which doubles with every further failure.
+
+    Attributes:
+        _db_file (str): Path to the SQLite database file.
+        _api_key (Optional[str]): API key of the FX provider.
+        _base_currency (str): Currency to convert to.
+        _ttl (timedelta): Age after which the cached rates are refreshed.
+        _min_backoff (float): Seconds without refresh after the first failure.
+        _max_backoff (float): Upper bound of the backoff in seconds.
+        _lock (threading.Lock): Guards the thread and failure state.
+        _thread (Optional[threading.Thread]): Running refresh.
+        _failures (int): Number of consecutive failed refreshes.
+        _retry_at (float): Monotonic time before which no refresh is started.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        db_file: str,
+        api_key: Optional[str],
+        base_currency: str,
+        ttl: timedelta,
+        *,
+        min_backoff: float = 60.0,
+        max_backoff: float = 3600.0,
+    ):
+        """
+        Initializes the BackgroundRefresh.
+
+        Args:
+            db_file (str): Path to the SQLite database file, a file is needed for the own connection
+            api_key (Optional[str]): API key of the FX provider
+            base_currency (str): Currency to convert to
+            ttl (timedelta): Age after which the cached rates are refreshed
+            min_backoff (float, optional): Seconds without refresh after the first failure. Defaults to 60.
+            max_backoff (float, optional): Upper bound of the backoff in seconds. Defaults to 3600.
+        """
+        self._db_file = db_file
+        self._api_key = api_key
+        self._base_currency = base_currency
+        self._ttl = ttl
+        self._min_backoff = min_backoff
+        self._max_backoff = max_backoff
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._failures = 0
+        self._retry_at = 0.0
+
+    def start_if_outdated(self, connection: sqlite3.Connection) -> bool:
+        """
+        Starts a refresh if the cached rates are outdated, without waiting for it.
+
+        Args:
+            connection (sqlite3.Connection): Connection of the caller, used to check the cached rates
+
+        Returns:
+            bool: True if a refresh was started
+        """
+        if rates_valid(connection, self._base_currency, self._ttl):
+            return False
+        with self._lock:
+            if (self._thread and self._thread.is_alive()) or time.monotonic() < self._retry_at:
+                return False
+            self._thread = threading.Thread(target=self._run, name="yasp-fx-refresh", daemon=True)
+            self._thread.start()
+        return True
+
+    def wait(self, timeout: Optional[float] = None) -> None:
+        """
+        Waits for a running refresh.
+
+        Args:
+            timeout (Optional[float], optional): Maximum seconds to wait. Defaults to None, no limit.
+        """
+        thread = self._thread
+        if thread:
+            thread.join(timeout)
+
+    def _run(self) -> None:
+        """
+        Requests the quotes and stores the rates, failures start the backoff.
+        """
+        try:
+            quotes = request_quotes(self._api_key)
+            connection = sqlite3.connect(self._db_file)
+            try:
+                refreshed = store_rates(connection, quotes, self._base_currency)
+            finally:
+                connection.close()
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            logger.error("Refresh of FX rates failed, use cached rates: %s", str(e))
+            refreshed = False
+        with self._lock:
+            if refreshed:
+                self._failures = 0
+                self._retry_at = 0.0
+                return
+            self._failures += 1
+            backoff = min(self._max_backoff, self._min_backoff * 2 ** (self._failures - 1))
+            self._retry_at = time.monotonic() + backoff
+        logger.warning("No FX refresh for %.0f seconds after %d failures", backoff, self._failures)
@@ -0,0 +1,343 @@
+"""Hedged API requests
+
+Run a request against a group of alternative providers. The first provider is
+asked first, if it did not answer within its p95 latency a backup request is
+fired to the next provider and the first valid answer wins.
+"""
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Executor, Future, FIRST_COMPLETED, wait
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class HedgeSettings:  # pylint: disable=too-few-public-methods
+    """
+    Tuning of the hedge delay.
+
+    Attributes:
+        window (int): Number of latency samples kept per provider.
+        min_samples (int): Samples needed before the p95 is used as hedge delay.
+        default_delay (float): Hedge delay in seconds for providers without enough samples.
+        min_delay (float): Lower bound of the hedge delay in seconds.
+        max_delay (float): Upper bound of the hedge delay in seconds.
+    """
+
+    def __init__(
+        self,
+        window: int = 100,
+        min_samples: int = 5,
+        default_delay: float = 2.0,
+        min_delay: float = 0.2,
+        max_delay: float = 10.0,
+    ):
+        """
+        Initializes the HedgeSettings.
+
+        Args:
+            window (int, optional): Number of samples kept per provider. Defaults to 100.
+            min_samples (int, optional): Samples needed before the p95 is used. Defaults to 5.
+            default_delay (float, optional): Hedge delay while not enough samples exist. Defaults to 2.0.
+            min_delay (float, optional): Lower bound of the hedge delay. Defaults to 0.2.
+            max_delay (float, optional): Upper bound of the hedge delay. Defaults to 10.0.
+        """
+        self.window = window
+        self.min_samples = min_samples
+        self.default_delay = default_delay
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+
+
+class LatencyTracker:
+    """
+    Thread safe rolling latency statistics per provider.
+
+    Attributes:
+        _settings (HedgeSettings): Sample window and hedge delay bounds.
+        _samples (Dict[str, Deque[float]]): Latest latencies per provider.
+        _failures (Dict[str, int]): Number of failed requests per provider.
+    """
+
+    def __init__(self, settings: Optional[HedgeSettings] = None):
+        """
+        Initializes the LatencyTracker.
+
+        Args:
+            settings (Optional[HedgeSettings], optional): Tuning of the hedge delay. Defaults to HedgeSettings().
+        """
+        self._settings = settings or HedgeSettings()
+        self._samples: Dict[str, Deque[float]] = {}
+        self._failures: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def record(self, provider: str, latency: float) -> None:
+        """
+        Stores the latency of a successful request.
+
+        Args:
+            provider (str): Name of the provider
+            latency (float): Duration of the request in seconds
+        """
+        with self._lock:
+            self._samples.setdefault(provider, deque(maxlen=self._settings.window)).append(latency)
+
+    def record_failure(self, provider: str) -> None:
+        """
+        Counts a failed request of a provider.
+
+        Args:
+            provider (str): Name of the provider
+        """
+        with self._lock:
+            self._failures[provider] = self._failures.get(provider, 0) + 1
+
+    def percentile(self, provider: str, percent: float) -> Optional[float]:
+        """
+        Returns a latency percentile of a provider.
+
+        Args:
+            provider (str): Name of the provider
+            percent (float): Percentile between 0 and 100
+
+        Returns:
+            Optional[float]: Latency in seconds or None if no samples are available
+        """
+        with self._lock:
+            samples = sorted(self._samples.get(provider, ()))
+        if not samples:
+            return None
+        index = min(len(samples) - 1, int(round(percent / 100 * (len(samples) - 1))))
+        return samples[index]
+
+    def hedge_delay(self, provider: str) -> float:
+        """
+        Returns the time to wait for a provider before a backup request is fired.
+
+        Args:
+            provider (str): Name of the provider
+
+        Returns:
+            float: Delay in seconds, based on the p95 latency of the provider
+        """
+        with self._lock:
+            sample_count = len(self._samples.get(provider, ()))
+        if sample_count < self._settings.min_samples:
+            return self._settings.default_delay
+        return min(self._settings.max_delay, max(self._settings.min_delay, self.percentile(provider, 95)))
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Returns the latency statistics of all known providers.
+
+        Returns:
+            Dict[str, Dict[str, Any]]: Per provider sample count, failures, p50 and p95 latency
+        """
+        with self._lock:
+            providers = set(self._samples) | set(self._failures)
+        return {
+            provider: {
+                "samples": len(self._samples.get(provider, ())),
+                "failures": self._failures.get(provider, 0),
+                "p50": self.percentile(provider, 50),
+                "p95": self.percentile(provider, 95),
+            }
+            for provider in providers
+        }
+
+
+class ThreadPerCallExecutor(Executor):
+    """
+    Executor running every call in its own daemon thread.
+
+    Losing hedged requests cannot be cancelled and run until their timeout. In a
+    fixed size pool they would occupy the workers and delay the primary and backup
+    requests of the following calls, which is exactly the slow provider case
+    hedging is meant for. With a thread per call, a loser only blocks itself.
+    """
+
+    def submit(self, fn, /, *args, **kwargs) -> Future:
+        future: Future = Future()
+
+        def run() -> None:
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except BaseException as e:  # pylint: disable=broad-exception-caught
+                future.set_exception(e)
+
+        threading.Thread(target=run, name="yasp-request", daemon=True).start()
+        return future
+
+
+def _timed_call(tracker: LatencyTracker, provider: str, call: Callable[[], Any]) -> Any:
+    """
+    Executes a call and stores its latency in the tracker.
+
+    Args:
+        tracker (LatencyTracker): Tracker to store the latency
+        provider (str): Name of the provider
+        call (Callable[[], Any]): Request to execute
+
+    Returns:
+        Any: Result of the call
+    """
+    start = time.monotonic()
+    try:
+        result = call()
+    except Exception:
+        tracker.record_failure(provider)
+        raise
+    tracker.record(provider, time.monotonic() - start)
+    return result
+
+
+def hedged_call(
+    calls: List[Tuple[str, Callable[[], Any]]],
+    tracker: LatencyTracker,
+    executor: Executor,
+) -> Tuple[int, Any]:
+    """
+    Executes alternative calls with hedging and returns the first successful result.
+
+    The first call is started immediately. A backup call is started if the running
+    call did not finish within the hedge delay of its provider, or immediately if it
+    failed. Calls that lose the race keep running in the executor, but their result
+    is dropped.
+
+    Args:
+        calls (List[Tuple[str, Callable[[], Any]]]): Provider name and request per alternative,
+            in order of preference
+        tracker (LatencyTracker): Tracker providing hedge delays and storing latencies
+        executor (Executor): Executor running the requests
+
+    Raises:
+        ValueError: No calls provided
+        Exception: Error of the last failed call, if all calls failed
+
+    Returns:
+        Tuple[int, Any]: Index of the call that answered first and its result
+    """
+    if not calls:
+        raise ValueError("No calls provided for hedged request")
+
+    pending: Dict[Future, int] = {}
+    last_error: Optional[Exception] = None
+    next_call = 0
+
+    def launch() -> None:
+        nonlocal next_call
+        provider, call = calls[next_call]
+        pending[executor.submit(_timed_call, tracker, provider, call)] = next_call
+        next_call += 1
+
+    launch()
+    while pending:
+        timeout = tracker.hedge_delay(calls[next_call - 1][0]) if next_call < len(calls) else None
+        done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+        if not done:
+            logger.debug("Provider %s slow, fire backup request to %s",
+                         calls[next_call - 1][0], calls[next_call][0])
+            launch()
+            continue
+        for future in done:
+            index = pending.pop(future)
+            try:
+                return index, future.result()
+            except Exception as e:  # pylint: disable=broad-exception-caught
+                logger.warning("Request to provider %s failed: %s", calls[index][0], str(e))
+                last_error = e
+        if not pending and next_call < len(calls):
+            launch()
+
+    raise last_error
+
+
+async def _timed_call_async(tracker: LatencyTracker, provider: str, call: Callable[[], Awaitable[Any]]) -> Any:
+    """
+    Awaits a call and stores its latency in the tracker.
+
+    Args:
+        tracker (LatencyTracker): Tracker to store the latency
+        provider (str): Name of the provider
+        call (Callable[[], Awaitable[Any]]): Request to await
+
+    Returns:
+        Any: Result of the call
+    """
+    start = time.monotonic()
+    try:
+        result = await call()
+    except asyncio.CancelledError:
+        # a cancelled loser took at least the elapsed time, without this lower bound
+        # only the fast requests would be sampled and the p95 would drift down
+        tracker.record(provider, time.monotonic() - start)
+        raise
+    except Exception:
+        tracker.record_failure(provider)
+        raise
+    tracker.record(provider, time.monotonic() - start)
+    return result
+
+
+async def async_hedged_call(
+    calls: List[Tuple[str, Callable[[], Awaitable[Any]]]],
+    tracker: LatencyTracker,
+) -> Tuple[int, Any]:
+    """
+    Asyncio variant of hedged_call. Calls that lose the race are cancelled, their
+    elapsed time is recorded as latency sample.
+
+    Args:
+        calls (List[Tuple[str, Callable[[], Awaitable[Any]]]]): Provider name and request per alternative,
+            in order of preference
+        tracker (LatencyTracker): Tracker providing hedge delays and storing latencies
+
+    Raises:
+        ValueError: No calls provided
+        Exception: Error of the last failed call, if all calls failed
+
+    Returns:
+        Tuple[int, Any]: Index of the call that answered first and its result
+    """
+    if not calls:
+        raise ValueError("No calls provided for hedged request")
+
+    pending: Dict[asyncio.Task, int] = {}
+    last_error: Optional[Exception] = None
+    next_call = 0
+
+    def launch() -> None:
+        nonlocal next_call
+        provider, call = calls[next_call]
+        pending[asyncio.ensure_future(_timed_call_async(tracker, provider, call))] = next_call
+        next_call += 1
+
+    launch()
+    try:
+        while pending:
+            timeout = tracker.hedge_delay(calls[next_call - 1][0]) if next_call < len(calls) else None
+            done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                logger.debug("Provider %s slow, fire backup request to %s",
+                             calls[next_call - 1][0], calls[next_call][0])
+                launch()
+                continue
+            for task in done:
+                index = pending.pop(task)
+                try:
+                    return index, task.result()
+                except Exception as e:  # pylint: disable=broad-exception-caught
+                    logger.warning("Request to provider %s failed: %s", calls[index][0], str(e))
+                    last_error = e
+            if not pending and next_call < len(calls):
+                launch()
+    finally:
+        for task in pending:
+            task.cancel()
+
+    raise last_error
@@ -0,0 +1,107 @@
+"""Financial statements with all periods
+
+Store the values of all periods returned by the statement APIs in a long table
+of (isin, period, statement, period_type, field, value) rows, so new periods and
+fields need no schema change. The period type, e.g. "annual" or "quarter", keeps
+annual and quarterly statements of the same name apart.
+"""
+import logging
+import sqlite3
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Row of the financial_statements table: isin, period, statement, period_type, field, value
+StatementRow = Tuple[str, str, str, str, str, Any]
+
+# Period type of statements without a configured period
+DEFAULT_PERIOD_TYPE = "annual"
+
+
+def create_tables(connection: sqlite3.Connection, period_types: Dict[str, str]) -> None:
+    """
+    Creates the financial_statements table and its index, if they do not exist.
+
+    A table of an older version without period type is migrated, its rows get the
+    period type of the API configured for their statement.
+
+    Args:
+        connection (sqlite3.Connection): Database connection
+        period_types (Dict[str, str]): Period type per statement name, used for the migration
+    """
+    columns = [row[1] for row in connection.execute("PRAGMA table_info('financial_statements')")]
+    if columns and "period_type" not in columns:
+        connection.execute("alter table financial_statements rename to financial_statements_old")
+    connection.execute(
+        "create table if not exists financial_statements (isin TEXT, period TEXT, statement TEXT, "
+        "period_type TEXT, field TEXT, value REAL, "
+        "PRIMARY KEY (isin, statement, period_type, field, period)) WITHOUT ROWID")
+    if columns and "period_type" not in columns:
+        for statement, period_type in period_types.items():
+            connection.execute(
+                "INSERT INTO financial_statements SELECT isin, period, statement, ?, field, value "
+                "FROM financial_statements_old WHERE statement = ?", (period_type, statement))
+        connection.execute(
+            f"INSERT INTO financial_statements SELECT isin, period, statement, '{DEFAULT_PERIOD_TYPE}', field, value "
+            f"FROM financial_statements_old WHERE statement NOT IN ({', '.join('?' for _ in period_types)})",
+            list(period_types))
+        connection.execute("drop table financial_statements_old")
+        logger.info("Table financial_statements migrated to period types")
+    # cross sectional queries, e.g. revenue of all stocks for a period
+    connection.execute(
+        "create index if not exists idx_financial_statements_field "
+        "on financial_statements (statement, period_type, field, period)")
+
+
+def insert_rows(connection: sqlite3.Connection, rows: List[StatementRow]) -> None:
+    """
+    Inserts or replaces rows of the financial_statements table in one transaction.
+
+    Args:
+        connection (sqlite3.Connection): Database connection
+        rows (List[StatementRow]): Rows of (isin, period, statement, period_type, field, value)
+
+    Raises:
+        DatabaseError: Exception during database handling
+    """
+    try:
+        with connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO financial_statements (isin, period, statement, period_type, field, value) "
+                "VALUES (?, ?, ?, ?, ?, ?)", rows)
+        logger.debug("Insert %d rows to table financial_statements", len(rows))
+    except sqlite3.DatabaseError as e:
+        logger.error("Database error: %s", str(e))
+        raise
+
+
+def select_periods(
+    connection: sqlite3.Connection,
+    isin: str,
+    statement: str,
+    fields: Optional[List[str]] = None,
+    period_type: str = DEFAULT_PERIOD_TYPE,
+) -> List[Dict[str, Any]]:
+    """
+    Selects the stored periods of a financial statement.
+
+    Args:
+        connection (sqlite3.Connection): Database connection
+        isin (str): ISIN of the stock
+        statement (str): Name of the statement, e.g. "income"
+        fields (Optional[List[str]], optional): Fields to select. Defaults to all stored fields.
+        period_type (str, optional): Period type, e.g. "quarter". Defaults to "annual".
+
+    Returns:
+        List[Dict[str, Any]]: One dictionary per period with "period" and the field values, ordered by period
+    """
+    sql_query = ("SELECT period, field, value FROM financial_statements "
+                 "WHERE isin = ? AND statement = ? AND period_type = ?")
+    params: List[Any] = [isin, statement, period_type]
+    if fields:
+        sql_query += f" AND field IN ({', '.join('?' for _ in fields)})"
+        params += fields
+    periods: Dict[str, Dict[str, Any]] = {}
+    for period, field, value in connection.execute(sql_query + " ORDER BY period", params):
+        periods.setdefault(period, {"period": period})[field] = value
+    return list(periods.values())
@@ -0,0 +1,154 @@
+"""Virtual wxPython list control for stocks
+
+Show the stocks table in a virtual wx.ListCtrl. Rows are provided by a
+StockListSource, so only the visible rows and a small prefetch window are
+loaded and the UI thread never waits for a query.
+"""
+from typing import List, Optional
+import wx
+from .alerts import Change
+from .db_handler import DbHandler
+from .stock_list_source import PagingSettings, StockListSource
+
+
+class StockListCtrl(wx.ListCtrl):
+    """
+    Virtual list control showing the stocks table. Click on a column header to sort by it.
+    Rows added or changed through the DbHandler are reloaded.
+
+    Attributes:
+        _db_handler (DbHandler): Handler of the stock database, notifies the control of changes.
+        _columns (List[str]): Shown columns of the stocks table.
+        _source (StockListSource): Paged data source of the rows.
+        _sort_column (str): Column currently sorted by.
+        _descending (bool): Current sort direction.
+        _filter (Optional[dict]): Current filter as column-value pairs.
+    """
+
+    def __init__(
+        self,
+        parent: wx.Window,
+        db_handler: DbHandler,
+        columns: Optional[List[str]] = None,
+        page_size: int = 100,
+    ):
+        """
+        Initializes the StockListCtrl.
+
+        Args:
+            parent (wx.Window): Parent window
+            db_handler (DbHandler): Handler of the stock database
+            columns (Optional[List[str]], optional): Shown columns. Defaults to all columns.
+            page_size (int, optional): Number of rows loaded per query. Defaults to 100.
+        """
+        super().__init__(parent, style=wx.LC_REPORT | wx.LC_VIRTUAL)
+        self._columns = list(columns) if columns else db_handler.get_columns()
+        for index, column in enumerate(self._columns):
+            self.InsertColumn(index, column)
+        self._sort_column = "id"
+        self._descending = False
+        self._filter = None
+        self._db_handler = db_handler
+        # Callbacks of the source run in its worker thread, forward them to the UI thread
+        self._source = StockListSource(
+            db_handler,
+            columns=self._columns,
+            settings=PagingSettings(page_size=page_size),
+            on_count=lambda count: wx.CallAfter(self._on_count, count),
+            on_rows=lambda first, last: wx.CallAfter(self._on_rows, first, last),
+        )
+        db_handler.add_change_listener(self._on_db_changes)
+        self.Bind(wx.EVT_LIST_CACHE_HINT, self._on_cache_hint)
+        self.Bind(wx.EVT_LIST_COL_CLICK, self._on_col_click)
+        self.Bind(wx.EVT_WINDOW_DESTROY, self._on_destroy)
+
+    def set_filter(self, filter_str: Optional[dict] = None) -> None:
+        """
+        Shows only stocks matching all column-value pairs of the filter.
+
+        Args:
+            filter_str (Optional[dict], optional): Column-value pairs to filter. Defaults to None.
+        """
+        self._filter = filter_str
+        self._source.set_query(self._sort_column, self._descending, filter_str)
+
+    def OnGetItemText(self, item: int, column: int) -> str:  # pylint: disable=invalid-name
+        """
+        Returns the text of a cell, called by wx for visible cells.
+
+        Args:
+            item (int): Row index
+            column (int): Column index
+
+        Returns:
+            str: Cell text, empty while the row is loading
+        """
+        row = self._source.get_row(item)
+        if row is None or row[self._columns[column]] is None:
+            return ""
+        return str(row[self._columns[column]])
+
+    def _on_count(self, count: int) -> None:
+        """
+        Updates the number of rows after the source determined the row count.
+
+        Args:
+            count (int): Number of rows
+        """
+        if self:
+            self.SetItemCount(count)
+            self.Refresh()
+
+    def _on_rows(self, first: int, last: int) -> None:
+        """
+        Redraws rows after the source loaded them.
+
+        Args:
+            first (int): Index of the first loaded row
+            last (int): Index of the last loaded row
+        """
+        if self and first < self.GetItemCount():
+            self.RefreshItems(first, min(last, self.GetItemCount() - 1))
+
+    def _on_db_changes(self, changes: List[Change]) -> None:  # pylint: disable=unused-argument
+        """
+        Reloads the rows after a write to the stocks table, called in the thread of the writer.
+
+        Args:
+            changes (List[Change]): Changed rows and fields
+        """
+        self._source.invalidate()
+
+    def _on_cache_hint(self, event: wx.ListEvent) -> None:
+        """
+        Passes the visible range to the source to load and prefetch it.
+
+        Args:
+            event (wx.ListEvent): Cache hint event
+        """
+        self._source.set_visible_range(event.GetCacheFrom(), event.GetCacheTo())
+
+    def _on_col_click(self, event: wx.ListEvent) -> None:
+        """
+        Sorts by the clicked column, a second click reverses the sort direction.
+
+        Args:
+            event (wx.ListEvent): Column click event
+        """
+        column = self._columns[event.GetColumn()]
+        self._descending = not self._descending if column == self._sort_column else False
+        self._sort_column = column
+        self._source.set_query(self._sort_column, self._descending, self._filter)
+        self.SetItemCount(0)
+
+    def _on_destroy(self, event: wx.WindowDestroyEvent) -> None:
+        """
+        Stops the worker thread of the source.
+
+        Args:
+            event (wx.WindowDestroyEvent): Destroy event
+        """
+        if event.GetEventObject() is self:
+            self._db_handler.remove_change_listener(self._on_db_changes)
+            self._source.close()
+        event.Skip()
@@ -0,0 +1,455 @@
+"""Virtual, paged data source for stock lists
+
+Provide rows of the stocks table page by page for virtual list controls. Pages
+are loaded with keyset pagination by a background thread, so the UI thread
+never waits for a query.
+"""
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from .db_handler import DbHandler, build_filter_clause
+
+logger = logging.getLogger(__name__)
+
+# Sort key of a row: value of the sort column and row id
+Anchor = Tuple[Any, int]
+
+# Seconds to wait before a failed query is retried, doubled per failure up to the maximum
+RETRY_DELAY = 0.1
+MAX_RETRY_DELAY = 5.0
+
+
+class PagingSettings:  # pylint: disable=too-few-public-methods
+    """
+    Page size and caching of a StockListSource.
+
+    Attributes:
+        page_size (int): Number of rows per page.
+        prefetch_pages (int): Number of pages loaded before and after the visible range.
+        cache_pages (int): Maximum number of pages kept in memory.
+    """
+
+    def __init__(self, page_size: int = 100, prefetch_pages: int = 2, cache_pages: int = 50):
+        """
+        Initializes the PagingSettings.
+
+        Args:
+            page_size (int, optional): Number of rows per page. Defaults to 100.
+            prefetch_pages (int, optional): Pages loaded around the visible range. Defaults to 2.
+            cache_pages (int, optional): Maximum number of pages kept in memory, at least the
+                visible page and its prefetch window. Defaults to 50.
+        """
+        self.page_size = page_size
+        self.prefetch_pages = prefetch_pages
+        self.cache_pages = max(cache_pages, 2 * prefetch_pages + 1)
+
+
+# the attributes are the state shared between the UI and the worker thread, guarded by _condition
+class StockListSource:  # pylint: disable=too-many-instance-attributes
+    """
+    Paged, non blocking access to the (sorted and filtered) stocks table.
+
+    Rows are requested with get_row(), which returns None if the row is not loaded
+    yet and schedules the load of its page. The visible range set with
+    set_visible_range() is loaded first, followed by a prefetch window around it.
+    All queries run in a worker thread with its own database connection. Failed
+    queries, e.g. while the database is locked by a writer, are retried with backoff.
+
+    Pages are range scans on the indexes DbHandler creates for the sortable columns,
+    the source itself does not change the schema.
+
+    Attributes:
+        _db_file (str): Path to the SQLite database file.
+        _valid_columns (List[str]): Columns of the stocks table.
+        _columns (List[str]): Columns provided per row.
+        _settings (PagingSettings): Page size and caching.
+        _on_count (Callable[[int], None]): Called from the worker thread with the new row count.
+        _on_rows (Callable[[int, int], None]): Called from the worker thread with the first
+            and last index of loaded rows.
+    """
+
+    def __init__(
+        self,
+        db_handler: DbHandler,
+        columns: Optional[List[str]] = None,
+        settings: Optional[PagingSettings] = None,
+        *,
+        on_count: Optional[Callable[[int], None]] = None,
+        on_rows: Optional[Callable[[int, int], None]] = None,
+    ):
+        """
+        Initializes the StockListSource and starts its worker thread.
+
+        Args:
+            db_handler (DbHandler): Handler of the stock database
+            columns (Optional[List[str]], optional): Columns provided per row. Defaults to all columns.
+            settings (Optional[PagingSettings], optional): Page size and caching. Defaults to PagingSettings().
+            on_count (Optional[Callable[[int], None]], optional): Callback for a changed row count.
+                Defaults to None.
+            on_rows (Optional[Callable[[int, int], None]], optional): Callback for loaded rows.
+                Defaults to None.
+        """
+        self._db_file = db_handler.get_db_file()
+        self._valid_columns = db_handler.get_columns()
+        self._columns = list(columns) if columns else list(self._valid_columns)
+        self._check_columns(self._columns)
+        self._settings = settings or PagingSettings()
+        self._on_count = on_count
+        self._on_rows = on_rows
+
+        self._condition = threading.Condition()
+        self._generation = 0
+        self._query: Dict[str, Any] = {"sort_column": "id", "descending": False, "filter_str": None}
+        self._row_count: Optional[int] = None
+        self._pages: "OrderedDict[int, List[Dict[str, Any]]]" = OrderedDict()
+        self._anchors: Dict[int, Anchor] = {}
+        self._wanted: List[int] = [0]
+        self._closed = False
+
+        self._worker = threading.Thread(target=self._run, name="yasp-stock-list", daemon=True)
+        self._worker.start()
+
+    def _check_columns(self, columns) -> None:
+        """
+        Checks that all columns exist in the stocks table.
+
+        Args:
+            columns: Column names to check
+
+        Raises:
+            KeyError: Unknown column
+        """
+        for column in columns:
+            if column not in self._valid_columns:
+                raise KeyError(f"Unknown column: {column}")
+
+    def set_query(
+        self,
+        sort_column: str = "id",
+        descending: bool = False,
+        filter_str: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        """
+        Changes sort order and filter. Loaded rows are dropped and the row count is redetermined.
+
+        Args:
+            sort_column (str, optional): Column to sort by. Defaults to "id".
+            descending (bool, optional): Sort descending. Defaults to False.
+            filter_str (Optional[Dict[str, Any]], optional): Column-value pairs that all have to match.
+                Defaults to None.
+        """
+        self._check_columns([sort_column, *(filter_str or {})])
+        with self._condition:
+            self._query = {"sort_column": sort_column, "descending": descending, "filter_str": filter_str}
+            self._reset()
+
+    def invalidate(self) -> None:
+        """
+        Drops the loaded rows and redetermines the row count, keeping sort order and filter.
+
+        Call it after rows were added or changed, e.g. from a change listener of the DbHandler.
+        Can be called from any thread.
+        """
+        with self._condition:
+            self._reset()
+
+    def _reset(self) -> None:
+        """
+        Starts a new generation of the query, the worker drops results of older generations.
+        Must be called with the condition held.
+        """
+        self._generation += 1
+        self._row_count = None
+        self._pages.clear()
+        self._anchors.clear()
+        self._wanted = [0]
+        self._condition.notify()
+
+    def get_row_count(self) -> Optional[int]:
+        """
+        Returns the number of rows matching the current filter.
+
+        Returns:
+            Optional[int]: Number of rows, None while not yet determined
+        """
+        with self._condition:
+            return self._row_count
+
+    def get_row(self, index: int) -> Optional[Dict[str, Any]]:
+        """
+        Returns a row without blocking. If the row is not loaded, the load of its page is scheduled.
+
+        Args:
+            index (int): Index of the row in the current sort order
+
+        Returns:
+            Optional[Dict[str, Any]]: Row with the configured columns, None if not loaded yet
+        """
+        page, offset = divmod(index, self._settings.page_size)
+        with self._condition:
+            rows = self._pages.get(page)
+            if rows is not None:
+                self._pages.move_to_end(page)
+                return rows[offset] if offset < len(rows) else None
+            if page not in self._wanted:
+                self._wanted.insert(0, page)
+                self._condition.notify()
+        return None
+
+    def set_visible_range(self, first: int, last: int) -> None:
+        """
+        Sets the rows currently visible. Their pages are loaded first, then the prefetch window.
+
+        Args:
+            first (int): Index of the first visible row
+            last (int): Index of the last visible row
+        """
+        first_page = max(0, first) // self._settings.page_size
+        last_page = max(first, last) // self._settings.page_size
+        wanted = list(range(first_page, last_page + 1))
+        for distance in range(1, self._settings.prefetch_pages + 1):
+            wanted.append(last_page + distance)
+            if first_page - distance >= 0:
+                wanted.append(first_page - distance)
+        with self._condition:
+            if self._row_count is not None:
+                page_count = -(-self._row_count // self._settings.page_size)
+                wanted = [page for page in wanted if page < page_count]
+            self._wanted = wanted
+            self._condition.notify()
+
+    def close(self) -> None:
+        """
+        Stops the worker thread.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._worker.join()
+
+    def _run(self) -> None:
+        """
+        Worker thread: determines row counts and loads wanted pages.
+        """
+        connection = sqlite3.connect(self._db_file)
+        try:
+            generation = None
+            anchors: Dict[int, Anchor] = {}
+            retry_delay = 0.0
+            while True:
+                with self._condition:
+                    if retry_delay:
+                        self._condition.wait_for(lambda: self._closed, timeout=retry_delay)
+                    while not self._closed and generation == self._generation and self._next_page() is None:
+                        self._condition.wait()
+                    if self._closed:
+                        return
+                    query = dict(self._query)
+                    if generation != self._generation:
+                        generation = self._generation
+                        page = None
+                    else:
+                        page = self._next_page()
+                        anchors = dict(self._anchors)
+
+                try:
+                    if page is None:
+                        self._prepare_query(connection, query, generation)
+                    else:
+                        self._load_page(connection, query, generation, page, anchors)
+                except sqlite3.Error as e:
+                    retry_delay = min(MAX_RETRY_DELAY, max(RETRY_DELAY, 2 * retry_delay))
+                    logger.warning("Stock list query failed, retry in %.1f s: %s", retry_delay, str(e))
+                    if page is None:
+                        # determine the row count again
+                        generation = None
+                    continue
+                retry_delay = 0.0
+        finally:
+            connection.close()
+
+    def _next_page(self) -> Optional[int]:
+        """
+        Returns the next wanted page that is not loaded. Must be called with the condition held.
+
+        Returns:
+            Optional[int]: Page number or None if nothing is to load
+        """
+        while self._wanted:
+            if self._wanted[0] not in self._pages:
+                return self._wanted[0]
+            self._wanted.pop(0)
+        return None
+
+    def _prepare_query(self, connection: sqlite3.Connection, query: Dict[str, Any], generation: int) -> None:
+        """
+        Determines the row count of the current filter.
+
+        Args:
+            connection (sqlite3.Connection): Connection of the worker thread
+            query (Dict[str, Any]): Sort and filter settings
+            generation (int): Generation of the query settings
+        """
+        where, params = build_filter_clause(query["filter_str"], self._valid_columns)
+        row_count = connection.execute(f"SELECT COUNT(*) FROM stocks{where}", params).fetchone()[0]
+        with self._condition:
+            if generation != self._generation:
+                return
+            self._row_count = row_count
+        logger.debug("Stock list query %s matches %d rows", query, row_count)
+        if self._on_count:
+            self._on_count(row_count)
+
+    def _load_page(
+        self,
+        connection: sqlite3.Connection,
+        query: Dict[str, Any],
+        generation: int,
+        page: int,
+        anchors: Dict[int, Anchor],
+    ) -> None:
+        """
+        Loads a page with keyset pagination.
+
+        If the end of the preceding page is not known, the sort keys of the rows in
+        between are read from the index, starting at the closest known page.
+
+        Args:
+            connection (sqlite3.Connection): Connection of the worker thread
+            query (Dict[str, Any]): Sort and filter settings
+            generation (int): Generation of the query settings
+            page (int): Page to load
+            anchors (Dict[int, Anchor]): Known sort keys of the last row per page
+        """
+        start_page = max((known for known in anchors if known < page), default=-1)
+        anchor = anchors.get(start_page)
+        new_anchors = {}
+        if start_page < page - 1:
+            keys = self._fetch(
+                connection, query, anchor, (page - 1 - start_page) * self._settings.page_size, keys_only=True)
+            for skipped in range(start_page + 1, page):
+                end = (skipped - start_page) * self._settings.page_size
+                if end > len(keys):
+                    break
+                new_anchors[skipped] = keys[end - 1]
+            anchor = new_anchors.get(page - 1)
+            if anchor is None:
+                rows = []
+            else:
+                rows = self._fetch(connection, query, anchor, self._settings.page_size)
+        else:
+            rows = self._fetch(connection, query, anchor, self._settings.page_size)
+
+        sort_column = query["sort_column"]
+        if rows:
+            new_anchors[page] = (rows[-1][sort_column], rows[-1]["id"])
+        with self._condition:
+            if generation != self._generation:
+                return
+            self._anchors.update(new_anchors)
+            self._pages[page] = [{column: row[column] for column in self._columns} for row in rows]
+            while len(self._pages) > self._settings.cache_pages:
+                evicted = next((cached for cached in self._pages if cached not in self._wanted), None)
+                if evicted is None:
+                    break
+                del self._pages[evicted]
+            if page in self._wanted:
+                self._wanted.remove(page)
+        if self._on_rows and rows:
+            self._on_rows(page * self._settings.page_size, page * self._settings.page_size + len(rows) - 1)
+
+    def _segments(self, query: Dict[str, Any], anchor: Optional[Anchor]) -> List[Tuple[Optional[str], str]]:
+        """
+        Splits the sort order in segments for NULL and non NULL values of the sort column.
+
+        NULLs come first when ascending and last when descending, so that every segment
+        is a plain range scan on the index. Segments in front of the anchor are skipped.
+
+        Args:
+            query (Dict[str, Any]): Sort and filter settings
+            anchor (Optional[Anchor]): Sort key of the row before the first row to fetch
+
+        Returns:
+            List[Tuple[Optional[str], str]]: Condition (None for all rows) and ORDER BY clause per segment
+        """
+        sort_column = query["sort_column"]
+        direction = "DESC" if query["descending"] else "ASC"
+        if sort_column == "id":
+            return [(None, f"id {direction}")]
+        null_segment = (f"{sort_column} IS NULL", f"id {direction}")
+        value_segment = (f"{sort_column} IS NOT NULL", f"{sort_column} {direction}, id {direction}")
+        segments = [value_segment, null_segment] if query["descending"] else [null_segment, value_segment]
+        if anchor is not None:
+            while (segments[0] is null_segment) != (anchor[0] is None):
+                segments.pop(0)
+        return segments
+
+    @staticmethod
+    def _segment_condition(
+        query: Dict[str, Any], segment: Optional[str], anchor: Optional[Anchor]
+    ) -> Tuple[str, List[Any]]:
+        """
+        Builds the condition selecting the rows of a segment that follow the anchor.
+
+        Args:
+            query (Dict[str, Any]): Sort and filter settings
+            segment (Optional[str]): Condition of the segment, None for all rows
+            anchor (Optional[Anchor]): Sort key of the row before the first row to fetch,
+                None to start at the beginning of the segment
+
+        Returns:
+            Tuple[str, List[Any]]: SQL condition starting with AND (or empty) and its parameters
+        """
+        condition = f" AND {segment}" if segment else ""
+        if anchor is None:
+            return condition, []
+        value, row_id = anchor
+        compare, reverse = ("<", ">=") if query["descending"] else (">", "<=")
+        if segment is None or value is None:
+            return condition + f" AND id {compare} ?", [row_id]
+        sort_column = query["sort_column"]
+        return (condition + f" AND {sort_column} {compare}= ? AND NOT ({sort_column} = ? AND id {reverse} ?)",
+                [value, value, row_id])
+
+    def _fetch(
+        self,
+        connection: sqlite3.Connection,
+        query: Dict[str, Any],
+        anchor: Optional[Anchor],
+        limit: int,
+        keys_only: bool = False,
+    ) -> List[Any]:
+        """
+        Fetches rows following a sort key, segment by segment.
+
+        Args:
+            connection (sqlite3.Connection): Connection of the worker thread
+            query (Dict[str, Any]): Sort and filter settings
+            anchor (Optional[Anchor]): Sort key of the row before the first row to fetch,
+                None to start at the beginning
+            limit (int): Maximum number of rows
+            keys_only (bool, optional): Return only sort keys. Defaults to False.
+
+        Returns:
+            List[Any]: Rows as dictionaries or sort keys
+        """
+        where, params = build_filter_clause(query["filter_str"], self._valid_columns)
+        where = where or " WHERE 1"
+        selected = ["id"] if query["sort_column"] == "id" else [query["sort_column"], "id"]
+        if not keys_only:
+            selected += [column for column in self._columns if column not in selected]
+
+        result = []
+        for segment, order in self._segments(query, anchor):
+            condition, condition_params = self._segment_condition(query, segment, anchor)
+            rows = connection.execute(
+                f"SELECT {', '.join(selected)} FROM stocks{where}{condition} ORDER BY {order} LIMIT ?",
+                params + condition_params + [limit - len(result)]).fetchall()
+            result += [(row[0], row[-1]) for row in rows] if keys_only else [dict(zip(selected, row)) for row in rows]
+            if len(result) >= limit:
+                break
+            # following segments start at their beginning
+            anchor = None
+        return result
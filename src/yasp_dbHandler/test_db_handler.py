@@ -1,8 +1,8 @@
 
 """ Unit Test for db_handler.py """
-# example_usage.py
+# example_usage.py, run with: python -m yasp_dbHandler.test_db_handler
 import sys
-from db_handler import DbHandler
+from yasp_dbHandler.db_handler import DbHandler
 
 
 def db_init():
@@ -0,0 +1,80 @@
+"""Fixtures of the tests
+"""
+import json
+import os
+import pytest
+import requests
+from yasp_dbHandler.db_handler import DbHandler
+
+CONFIG_DIR = os.path.join(os.path.dirname(__file__), "..", "src", "yasp_dbHandler")
+
+
+@pytest.fixture(name="make_db")
+def fixture_make_db(tmp_path, monkeypatch):
+    """Factory of DbHandlers on a database in a temporary directory, optionally with a changed field mapping"""
+    monkeypatch.setenv("FMP_API", "test-key")
+    handlers = []
+
+    def make_db(mapping=None):
+        mapping_file = os.path.join(CONFIG_DIR, "api_field_mapping.json")
+        if mapping is not None:
+            mapping_file = str(tmp_path / f"api_field_mapping_{len(handlers)}.json")
+            with open(mapping_file, "w", encoding="utf-8") as f:
+                json.dump(mapping, f)
+        handlers.append(DbHandler(str(tmp_path / "stocks.db"), os.path.join(CONFIG_DIR, "db_config.json"),
+                                  mapping_file))
+        return handlers[-1]
+
+    yield make_db
+    for handler in handlers:
+        handler.close()
+
+
+@pytest.fixture(name="mapping")
+def fixture_mapping():
+    """Field mapping shipped with the package"""
+    with open(os.path.join(CONFIG_DIR, "api_field_mapping.json"), encoding="utf-8") as f:
+        return json.load(f)
+
+
+@pytest.fixture(name="db")
+def fixture_db(make_db):
+    """DbHandler on an empty database in a temporary directory"""
+    return make_db()
+
+
+
+class FakeResponse:
+    """Response of the fake API"""
+
+    def __init__(self, payload):
+        self.content = json.dumps(payload).encode("utf-8")
+
+    def raise_for_status(self):
+        """Responses of the fake API are always successful"""
+
+
+class FakeApi:
+    """Replacement of requests.get answering with payloads or errors per URL part"""
+
+    def __init__(self):
+        self.payloads = {}
+        self.requested = []
+
+    def get(self, url, params=None, timeout=None):  # pylint: disable=unused-argument
+        """Returns the payload of the first matching URL part, raises if it is an exception"""
+        self.requested.append(url)
+        for url_part, payload in self.payloads.items():
+            if url_part in url:
+                if isinstance(payload, Exception):
+                    raise payload
+                return FakeResponse(payload)
+        raise ConnectionError(f"No fake response for {url}")
+
+
+@pytest.fixture(name="fake_api")
+def fixture_fake_api(monkeypatch):
+    """Fake API replacing the requests of the DbHandler"""
+    api = FakeApi()
+    monkeypatch.setattr(requests, "get", api.get)
+    return api
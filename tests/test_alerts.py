@@ -0,0 +1,95 @@
+"""Tests of change driven alerts
+"""
+import pytest
+from yasp_dbHandler.alerts import AlertEngine, AlertSink, CallbackSink, Change, Rule, ThresholdRule
+
+ISIN = "US0378331005"
+
+
+def _change(changed, **row):
+    """Change of a stock in the watchlist, row holds the values after the change"""
+    row = {"isin": ISIN, "watchlist": "1", **row}
+    row.update({field: values[1] for field, values in changed.items()})
+    return Change(ISIN, changed, row)
+
+
+def test_fires_on_crossing_only():
+    """A rule triggers when its condition becomes true, not while it stays true"""
+    engine = AlertEngine([ThresholdRule("cheap", "peRatioTTM", "<", 15)])
+    assert len(engine.on_changes([_change({"peRatioTTM": (20, 14)})])) == 1
+    assert not engine.on_changes([_change({"peRatioTTM": (14, 12)})])
+    assert not engine.on_changes([_change({"peRatioTTM": (12, 18)})])
+    assert not engine.on_changes([_change({"peRatioTTM": (None, 18)})])
+    assert len(engine.on_changes([_change({"peRatioTTM": (None, 10)})])) == 1
+
+
+def test_only_rules_of_changed_fields_evaluated():
+    """Rules are evaluated only if a field they depend on changed"""
+    evaluated = []
+
+    def condition(row):
+        evaluated.append(row["isin"])
+        return row["price"] > row["gd200"]
+
+    engine = AlertEngine([Rule("above gd200", ["price", "gd200"], condition)])
+    assert not engine.on_changes([_change({"company": ("Apple", "Apple Inc.")}, price=200, gd200=150)])
+    assert not evaluated
+    alerts = engine.on_changes([_change({"gd200": (210, 190)}, price=200)])
+    assert [alert.rule.name for alert in alerts] == ["above gd200"]
+    assert evaluated
+
+
+def test_failing_sink_isolated():
+    """A failing sink neither stops the other sinks nor the caller"""
+    received = []
+
+    def fail(alert):
+        raise RuntimeError("sink down")
+
+    engine = AlertEngine([ThresholdRule("cheap", "peRatioTTM", "<", 15)],
+                         [CallbackSink(fail), CallbackSink(received.append)])
+    alerts = engine.on_changes([_change({"peRatioTTM": (20, 14)})])
+    assert received == alerts
+
+
+def test_sink_requires_send():
+    """A sink without send() cannot be created"""
+    class Incomplete(AlertSink):  # pylint: disable=too-few-public-methods,abstract-method
+        """Sink missing send()"""
+
+    with pytest.raises(TypeError):
+        Incomplete()  # pylint: disable=abstract-class-instantiated
+
+
+def test_watchlist_only():
+    """Rules for the watchlist ignore other stocks"""
+    engine = AlertEngine([ThresholdRule("cheap", "peRatioTTM", "<", 15, watchlist_only=True)])
+    assert not engine.on_changes([_change({"peRatioTTM": (20, 14)}, watchlist="0")])
+    assert not engine.on_changes([_change({"peRatioTTM": (20, 14)}, watchlist=None)])
+    assert len(engine.on_changes([_change({"peRatioTTM": (20, 14)})])) == 1
+
+
+def test_remove_rule():
+    """Removed rules no longer trigger"""
+    engine = AlertEngine([ThresholdRule("cheap", "peRatioTTM", "<", 15)])
+    engine.remove_rule("cheap")
+    assert not engine.on_changes([_change({"peRatioTTM": (20, 14)})])
+
+
+def test_db_changes_compare_stored_values(db):
+    """Writing the stored value again is no change, e.g. True stored as '1' in a TEXT column"""
+    changes = []
+    db._insert_dict_into_table("stocks", {"isin": ISIN, "symbol": "AAPL"})  # pylint: disable=protected-access
+    db.add_change_listener(changes.extend)
+    db.set_watchlist(ISIN, True)
+    db.set_watchlist(ISIN, True)
+    assert [change.changed for change in changes] == [{"watchlist": (None, "1")}]
+
+    alerts = []
+    engine = AlertEngine([ThresholdRule("cheap", "peRatioTTM", "<", 15, watchlist_only=True)],
+                         [CallbackSink(alerts.append)])
+    db.add_change_listener(engine.on_changes)
+    db.update_entry(ISIN, [{"peRatioTTM": 12, "pfcfRatioTTM": 20, "researchAndDevelopementToRevenueTTM": 0.1}],
+                    "key_metrics_ttm")
+    assert changes[-1].changed["peRatioTTM"] == (None, 12)
+    assert [alert.change.isin for alert in alerts] == [ISIN]
@@ -0,0 +1,108 @@
+"""Tests of the cost based API call planner
+"""
+from datetime import datetime, timedelta, timezone
+import pytest
+from yasp_dbHandler.api_planner import ApiCallPlanner
+
+API_FIELDS = {"price": {"price"}, "quote": {"price", "marketCap"}, "gd20": {"gd20"}}
+BATCH_SIZES = {"quote": 100}
+STOCKS = {"US0378331005": "AAPL", "US5949181045": "MSFT", "DE0007164600": "SAP"}
+
+
+def test_cheapest_cover_prefers_batched_api():
+    """A batched API is cheaper than a single symbol API providing the same field"""
+    planner = ApiCallPlanner(API_FIELDS, BATCH_SIZES)
+    assert planner._cheapest_cover(frozenset({"price"})) == ("quote",)  # pylint: disable=protected-access
+    assert set(planner._cheapest_cover(  # pylint: disable=protected-access
+        frozenset({"price", "gd20"}))) == {"quote", "gd20"}
+
+
+def test_plan_reports_unavailable_and_fresh():
+    """Fields no API provides are reported, stocks without stale fields need no request"""
+    planner = ApiCallPlanner(API_FIELDS, BATCH_SIZES)
+    plan = planner.plan({"a": {"price"}, "b": {"price", "gd20", "dividend"}, "c": set(), "d": {"dividend"}})
+    assert plan.unavailable == {"dividend"}
+    assert plan.fresh == 2
+    calls = {call.api_name: call for call in plan.calls}
+    assert set(calls) == {"quote", "gd20"}
+    assert calls["quote"].isins == ["a", "b"]
+    assert calls["gd20"].isins == ["b"]
+    assert plan.call_count() == 2
+
+
+def test_batches():
+    """Batched calls request up to batch_size stocks together"""
+    planner = ApiCallPlanner(API_FIELDS, {"quote": 2})
+    plan = planner.plan({isin: {"price"} for isin in "abcde"})
+    assert plan.calls[0].batches() == [["a", "b"], ["c", "d"], ["e"]]
+    assert plan.call_count() == 3
+
+
+def _add_stocks(db):
+    for isin, symbol in STOCKS.items():
+        db._insert_dict_into_table("stocks", {"isin": isin, "symbol": symbol})  # pylint: disable=protected-access
+
+
+def test_max_age_uses_fetched_at(db):
+    """Columns of an API requested within max_age_hours are fresh"""
+    _add_stocks(db)
+    db._archive_payloads([  # pylint: disable=protected-access
+        ("US0378331005", "price", 0, [{"price": 1.0}]), ("US5949181045", "quote", 0, [{"price": 1.0}])])
+    old = (datetime.now(timezone.utc) - timedelta(hours=30)).isoformat()
+    with db._connection:  # pylint: disable=protected-access
+        db._connection.execute(  # pylint: disable=protected-access
+            "UPDATE api_payloads SET fetched_at = ? WHERE isin = 'US5949181045'", (old,))
+
+    plan = db.plan_refresh(["price"], max_age_hours=24)
+    assert plan.fresh == 1
+    assert [(call.api_name, call.isins) for call in plan.calls] == [("quote", ["US5949181045", "DE0007164600"])]
+    # the price API does not provide marketCap
+    assert db.plan_refresh(["price", "marketCap"], max_age_hours=24).fresh == 0
+
+    assert db.plan_refresh(["price"], max_age_hours=48).fresh == 2
+    assert db.plan_refresh(["price"]).fresh == 0
+    with pytest.raises(KeyError):
+        db.plan_refresh(["unknown"])
+
+
+def test_refresh_with_batched_request(db, fake_api):
+    """One batched request refreshes all stocks, missing entries are skipped"""
+    _add_stocks(db)
+    fake_api.payloads["/quote/"] = [{"symbol": "AAPL", "price": 190.0, "marketCap": 2.9e12},
+                                    {"symbol": "MSFT", "price": 410.0, "marketCap": 3.0e12}]
+    plan = db.refresh(["price"])
+    assert plan.call_count() == 1
+    assert fake_api.requested == ["https://financialmodelingprep.com/api/v3/quote/AAPL,MSFT,SAP"]
+    assert db.get_entry("US5949181045")["price"] == 410.0
+    assert db.get_entry("US5949181045")["lastUpdate"] is not None
+    assert db.get_entry("DE0007164600")["price"] is None
+    assert db.plan_refresh(["price"], max_age_hours=1).fresh == 2
+
+
+def test_refresh_splits_duplicate_symbols(db, fake_api):
+    """Stocks sharing a symbol, e.g. dual listings, are requested in separate batches"""
+    _add_stocks(db)
+    db._insert_dict_into_table("stocks", {"isin": "US8030542042", "symbol": "SAP"})  # pylint: disable=protected-access
+    fake_api.payloads["/quote/"] = [{"symbol": "SAP", "price": 120.0, "marketCap": 1.4e11}]
+    assert db.execute_plan(db.plan_refresh(["price"])) == 2
+    assert fake_api.requested == ["https://financialmodelingprep.com/api/v3/quote/AAPL,MSFT,SAP",
+                                  "https://financialmodelingprep.com/api/v3/quote/SAP"]
+    assert db.get_entry("DE0007164600")["price"] == 120.0
+    assert db.get_entry("US8030542042")["price"] == 120.0
+
+
+def test_update_all_and_watchlist(db):
+    """List entries are matched to the stocks by symbol, update_watchlist skips other stocks"""
+    _add_stocks(db)
+    db.set_watchlist("US5949181045", True)
+    quotes = [{"symbol": "AAPL", "price": 190.0, "marketCap": 2.9e12},
+              {"symbol": "MSFT", "price": 410.0, "marketCap": 3.0e12},
+              {"symbol": "UNKNOWN", "price": 1.0, "marketCap": 1.0}]
+    assert db.update_watchlist(quotes, "quote") == 1
+    assert db.get_entry("US0378331005")["price"] is None
+    assert db.get_entry("US5949181045")["price"] == 410.0
+
+    assert db.update_all(quotes, "quote") == 2
+    assert db.get_entry("US0378331005")["marketCap"] == 2.9e12
+    assert db.get_entry("US0378331005")["lastUpdate"] is not None
+    assert db.plan_refresh(["price"], max_age_hours=1).fresh == 2
@@ -0,0 +1,172 @@
+"""Tests of the asyncio interface with a fake aiohttp session
+"""
+import asyncio
+import json
+import os
+import threading
+import pytest
+from yasp_dbHandler import async_db_handler
+from yasp_dbHandler.db_handler import DbHandler
+from .conftest import CONFIG_DIR
+
+aiohttp = pytest.importorskip("aiohttp")
+
+ISINS = [f"US{index:010d}" for index in range(12)]
+
+
+class FakeAsyncResponse:
+    """Response of the fake session"""
+
+    def __init__(self, payload):
+        self._payload = payload
+
+    def raise_for_status(self):
+        """Responses of the fake session are always successful"""
+
+    async def read(self):
+        """Returns the encoded payload"""
+        return json.dumps(self._payload).encode("utf-8")
+
+
+class FakeSession:
+    """Replacement of aiohttp.ClientSession answering with payloads or errors per URL part"""
+
+    def __init__(self, connector=None):  # pylint: disable=unused-argument
+        self.payloads = {}
+        self.requested = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.delay = 0.01
+
+    def get(self, url, params=None, timeout=None):
+        """Returns a context manager answering after the delay"""
+        self.requested.append((url, params, timeout))
+        return self._respond(url, params)
+
+    def _respond(self, url, params):
+        session = self
+
+        class Context:
+            """Async context manager of a request"""
+
+            async def __aenter__(self):
+                session.in_flight += 1
+                session.max_in_flight = max(session.max_in_flight, session.in_flight)
+                try:
+                    await asyncio.sleep(session.delay)
+                finally:
+                    session.in_flight -= 1
+                for url_part, payload in session.payloads.items():
+                    if url_part in url:
+                        if isinstance(payload, Exception):
+                            raise payload
+                        return FakeAsyncResponse(payload(params) if callable(payload) else payload)
+                raise ConnectionError(f"No fake response for {url}")
+
+            async def __aexit__(self, *exc_info):
+                return False
+
+        return Context()
+
+    async def close(self):
+        """Nothing to close"""
+
+
+@pytest.fixture(name="session")
+def fixture_session(monkeypatch, tmp_path):
+    """Fake session used by the AsyncDbHandler, the database is created in a temporary directory"""
+    monkeypatch.setenv("FMP_API", "test-key")
+    monkeypatch.chdir(tmp_path)
+    session = FakeSession()
+    monkeypatch.setattr(async_db_handler.aiohttp, "ClientSession", lambda connector: session)
+    monkeypatch.setattr(async_db_handler.aiohttp, "TCPConnector", lambda limit: None)
+    return session
+
+
+async def _create(**kwargs):
+    return await async_db_handler.AsyncDbHandler.create(
+        "stocks.db", os.path.join(CONFIG_DIR, "db_config.json"),
+        os.path.join(CONFIG_DIR, "api_field_mapping.json"), **kwargs)
+
+
+def _search_result(params):
+    isin = params["isin"]
+    return [{"isin": isin, "companyName": isin, "symbol": isin[-4:], "description": "", "sector": "",
+             "industry": "", "currency": "USD", "mktCap": 1}]
+
+
+def test_add_isins_bounded_by_semaphore(session):
+    """All ISINs are added, at most max_concurrency lookups are in flight"""
+    session.payloads["/search/isin"] = _search_result
+
+    async def run():
+        async with await _create(max_concurrency=3) as db:
+            assert await db.add_isins(ISINS) == [None] * len(ISINS)
+            return await db.get_all()
+
+    rows = asyncio.run(run())
+    assert sorted(row["isin"] for row in rows) == ISINS
+    assert session.max_in_flight == 3
+    assert len(session.requested) == len(ISINS)
+    # per provider timeout, no None parameters
+    assert session.requested[0][2].total == 30
+    assert None not in session.requested[0][1].values()
+
+
+def test_update_statements_partial_failure(session):
+    """A failing statement API is reported, the statements of the other APIs are stored"""
+    session.payloads["/search/isin"] = _search_result
+    session.payloads["/income-statement/"] = [{"date": "2023-09-30", "revenue": 383.3, "netIncome": 97.0}]
+    session.payloads["/balance-sheet-statement/"] = ConnectionError("provider down")
+    session.payloads["/cash-flow-statement/"] = []
+
+    async def run():
+        async with await _create() as db:
+            await db.add_isin(ISINS[0])
+            stored, failures = await db.update_statements(ISINS[0])
+            return stored, failures, await db.get_statement(ISINS[0], "income")
+
+    stored, failures, income = asyncio.run(run())
+    assert stored == 2
+    assert set(failures) == {"balance_sheet", "cash_flow"}
+    assert isinstance(failures["balance_sheet"], ConnectionError)
+    assert income == [{"period": "2023-09-30", "revenue": 383.3, "netIncome": 97.0}]
+
+
+def test_refresh_and_update_all(session):
+    """Refresh requests the batched API concurrently and writes the results in the writer thread"""
+    session.payloads["/search/isin"] = _search_result
+    session.payloads["/quote/"] = [{"symbol": ISINS[0][-4:], "price": 10.0, "marketCap": 5.0}]
+
+    async def run():
+        async with await _create() as db:
+            await db.add_isins(ISINS[:2])
+            plan = await db.refresh(["price"])
+            assert (await db.get_entry(ISINS[0]))["price"] == 10.0
+            assert await db.update_all([{"symbol": ISINS[1][-4:], "price": 20.0, "marketCap": 6.0}], "quote") == 1
+            assert await db.update_watchlist([{"symbol": ISINS[1][-4:], "price": 30.0, "marketCap": 6.0}],
+                                             "quote") == 0
+            return plan, await db.get_entry(ISINS[1])
+
+    plan, entry = asyncio.run(run())
+    assert plan.call_count() == 1
+    assert entry["price"] == 20.0
+
+
+def test_close_in_writer_thread(session, monkeypatch):  # pylint: disable=unused-argument
+    """The database connection is closed by the writer thread that opened it"""
+    threads = []
+    close = DbHandler.close
+
+    def record_close(db):
+        threads.append(threading.current_thread().name)
+        close(db)
+
+    monkeypatch.setattr(DbHandler, "close", record_close)
+
+    async def run():
+        db = await _create()
+        await db.close()
+
+    asyncio.run(run())
+    assert threads and threads[0].startswith("yasp-db-writer")
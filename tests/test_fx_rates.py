@@ -0,0 +1,86 @@
+"""Tests of FX rates and normalized monetary columns
+"""
+import pytest
+from yasp_dbHandler.fx_rates import rates_to_base
+
+QUOTES = [
+    {"ticker": "EUR/USD", "bid": "1.09", "ask": "1.11"},
+    {"ticker": "USD/JPY", "bid": 149.9, "ask": 150.1},
+    {"ticker": "GBP/USD", "bid": 1.27, "ask": 1.27},
+    {"ticker": "broken", "bid": 1, "ask": 1},
+    {"ticker": "CHF/USD", "bid": None, "ask": 1.1},
+]
+
+
+def test_rates_to_base_cross_rates_and_sub_units():
+    """Currencies not quoted against the base are converted via other pairs, sub units scaled"""
+    rates = rates_to_base(QUOTES, "EUR")
+    assert rates["EUR"] == 1.0
+    assert rates["USD"] == pytest.approx(1 / 1.10)
+    assert rates["JPY"] == pytest.approx(1 / 1.10 / 150)
+    assert rates["GBP"] == pytest.approx(1.27 / 1.10)
+    assert rates["GBp"] == pytest.approx(rates["GBP"] / 100)
+    assert "CHF" not in rates
+    assert "ZAc" not in rates
+
+
+def test_rates_to_base_without_quotes():
+    """Without usable quotes only the base currency is known"""
+    assert rates_to_base([], "USD") == {"USD": 1.0}
+    assert rates_to_base([{"ticker": "EUR/USD"}], "USD") == {"USD": 1.0}
+
+
+def _add_stock(db, isin, currency, price):
+    db._insert_dict_into_table(  # pylint: disable=protected-access
+        "stocks", {"isin": isin, "currency": currency, "price": price})
+
+
+def test_normalized_read_refreshes_rates_in_background(db, fake_api):
+    """Normalized reads do not wait for the network, outdated rates are refreshed in the background"""
+    fake_api.payloads["/fx"] = QUOTES
+    _add_stock(db, "US0378331005", "USD", 110.0)
+    _add_stock(db, "GB0002634946", "GBp", 1270.0)
+    assert db.get_all(normalized=True)[0]["price_base"] is None
+    db._fx_refresh.wait(5)  # pylint: disable=protected-access
+    rows = {row["isin"]: row for row in db.get_all(normalized=True)}
+    assert rows["US0378331005"]["price_base"] == pytest.approx(100.0)
+    assert rows["GB0002634946"]["price_base"] == pytest.approx(12.7 * 1.27 / 1.1)
+    assert len(fake_api.requested) == 1
+
+
+def test_failed_background_refresh_backs_off(db, fake_api):
+    """After a failed refresh further normalized reads do not request the rates again"""
+    fake_api.payloads["/fx"] = ConnectionError("provider down")
+    _add_stock(db, "US0378331005", "USD", 110.0)
+    for _ in range(5):
+        db.get_all(normalized=True)
+        db._fx_refresh.wait(5)  # pylint: disable=protected-access
+    assert len(fake_api.requested) == 1
+
+    fake_api.payloads["/fx"] = QUOTES
+    assert db.refresh_fx_rates()
+    assert db.get_all(normalized=True)[0]["price_base"] == pytest.approx(100.0)
+
+
+def test_partial_response_keeps_other_rates(db, fake_api):
+    """Currencies missing in a response keep their cached rates"""
+    _add_stock(db, "US0378331005", "USD", 110.0)
+    _add_stock(db, "JP3633400001", "JPY", 15000.0)
+    fake_api.payloads["/fx"] = QUOTES
+    assert db.refresh_fx_rates()
+    fake_api.payloads["/fx"] = [{"ticker": "EUR/USD", "bid": 1.19, "ask": 1.21}]
+    assert db.refresh_fx_rates(force=True)
+    rows = {row["isin"]: row for row in db.get_all(normalized=True)}
+    assert rows["US0378331005"]["price_base"] == pytest.approx(110.0 / 1.2)
+    assert rows["JP3633400001"]["price_base"] == pytest.approx(15000.0 / 1.10 / 150)
+
+
+def test_unusable_response_keeps_cached_rates(db, fake_api):
+    """An empty or garbled response does not wipe the cached rates"""
+    _add_stock(db, "US0378331005", "USD", 110.0)
+    fake_api.payloads["/fx"] = QUOTES
+    assert db.refresh_fx_rates()
+    for payload in ([], {"Error Message": "Limit reached"}, [{"ticker": "AUD/NZD", "bid": 1.1, "ask": 1.1}]):
+        fake_api.payloads["/fx"] = payload
+        assert not db.refresh_fx_rates(force=True)
+        assert db.get_all(normalized=True)[0]["price_base"] == pytest.approx(100.0)
@@ -0,0 +1,50 @@
+"""Tests of remapping archived API responses
+"""
+import requests
+from yasp_dbHandler import db_handler
+
+ISIN = "US0378331005"
+KEY_METRICS = [{"peRatioTTM": 28.5, "pfcfRatioTTM": 31.2, "researchAndDevelopementToRevenueTTM": 0.07}]
+
+
+def test_remap_fills_new_column_from_archive(make_db, mapping, monkeypatch):
+    """A field added to the mapping is filled from the archived payload without API request"""
+    def no_request(*args, **kwargs):
+        raise AssertionError("remap must not request the API")
+
+    monkeypatch.setattr(requests, "get", no_request)
+    del mapping["key_metrics_ttm"]["mapping"]["pfcfRatioTTM"]
+    db = make_db(mapping)
+    db._insert_dict_into_table("stocks", {"isin": ISIN, "symbol": "AAPL"})  # pylint: disable=protected-access
+    db.update_entry(ISIN, KEY_METRICS, "key_metrics_ttm")
+    assert db.get_entry(ISIN)["peRatioTTM"] == 28.5
+    assert db.get_entry(ISIN)["pfcfRatioTTM"] is None
+    db.close()
+
+    mapping["key_metrics_ttm"]["mapping"]["pfcfRatioTTM"] = "pfcfRatioTTM"
+    db = make_db(mapping)
+    assert db.remap() == 1
+    entry = db.get_entry(ISIN)
+    assert entry["pfcfRatioTTM"] == 31.2
+    assert entry["peRatioTTM"] == 28.5
+
+
+def test_remap_skips_unconfigured_api(db):
+    """Payloads of APIs removed from the mapping are skipped"""
+    db._insert_dict_into_table("stocks", {"isin": ISIN})  # pylint: disable=protected-access
+    db._archive_payload(ISIN, "removed_api", 0, KEY_METRICS)  # pylint: disable=protected-access
+    assert db.remap() == 0
+
+
+def test_remap_in_chunks(db, monkeypatch):
+    """Stocks are remapped chunk by chunk, every archived payload is mapped once"""
+    monkeypatch.setattr(db_handler, "REMAP_CHUNK_SIZE", 2)
+    isins = [f"US{index:010d}" for index in range(5)]
+    for index, isin in enumerate(isins):
+        db._insert_dict_into_table("stocks", {"isin": isin})  # pylint: disable=protected-access
+        payload = [{**KEY_METRICS[0], "peRatioTTM": index}]
+        db._archive_payload(isin, "key_metrics_ttm", 0, payload)  # pylint: disable=protected-access
+    db._archive_payload(isins[0], "removed_api", 0, KEY_METRICS)  # pylint: disable=protected-access
+    assert db.remap() == 5
+    assert [db.get_entry(isin)["peRatioTTM"] for isin in isins] == list(range(5))
+    assert db.remap(["gd20"]) == 0
@@ -0,0 +1,187 @@
+"""Tests of hedged API requests
+"""
+import asyncio
+import threading
+import time
+import pytest
+from yasp_dbHandler import api_client
+from yasp_dbHandler.api_client import ApiClient
+from yasp_dbHandler.request_hedging import (
+    HedgeSettings, LatencyTracker, ThreadPerCallExecutor, async_hedged_call, hedged_call)
+
+# Hedge delay used while providers have no latency history
+DELAY = 0.05
+
+
+@pytest.fixture(name="tracker")
+def fixture_tracker():
+    """Tracker with a short hedge delay"""
+    return LatencyTracker(HedgeSettings(min_samples=1000, default_delay=DELAY))
+
+
+@pytest.fixture(name="release")
+def fixture_release():
+    """Event blocking slow providers, released at the end of the test"""
+    event = threading.Event()
+    yield event
+    event.set()
+
+
+def test_latency_tracker_percentiles():
+    """The hedge delay is the p95 latency, bounded by the settings"""
+    tracker = LatencyTracker(HedgeSettings(min_samples=5, default_delay=2.0, min_delay=0.1, max_delay=5.0))
+    assert tracker.hedge_delay("a") == 2.0
+    for latency in range(1, 101):
+        tracker.record("a", latency / 100)
+    assert tracker.percentile("a", 50) == pytest.approx(0.51, abs=0.01)
+    assert tracker.hedge_delay("a") == pytest.approx(0.95, abs=0.01)
+
+    for _ in range(10):
+        tracker.record("fast", 0.001)
+        tracker.record("slow", 60)
+    assert tracker.hedge_delay("fast") == 0.1
+    assert tracker.hedge_delay("slow") == 5.0
+
+
+def test_latency_tracker_window_and_stats():
+    """Only the latest samples are kept, failures are counted"""
+    tracker = LatencyTracker(HedgeSettings(window=3))
+    for latency in (10, 10, 1, 1, 1):
+        tracker.record("a", latency)
+    tracker.record_failure("b")
+    stats = tracker.stats()
+    assert stats["a"] == {"samples": 3, "failures": 0, "p50": 1, "p95": 1}
+    assert stats["b"]["failures"] == 1
+    assert stats["b"]["p95"] is None
+
+
+def test_hedge_fires_for_slow_primary(tracker, release):
+    """A backup request is fired after the hedge delay and its answer is used"""
+    start = time.monotonic()
+    index, result = hedged_call(
+        [("slow", lambda: release.wait(5) and "slow"), ("fast", lambda: "fast")],
+        tracker, ThreadPerCallExecutor())
+    assert (index, result) == (1, "fast")
+    assert DELAY <= time.monotonic() - start < 1
+
+
+def test_no_hedge_for_fast_primary(tracker):
+    """A primary answering within the hedge delay gets no backup request"""
+    calls = []
+    index, result = hedged_call(
+        [("fast", lambda: calls.append("fast") or "fast"), ("backup", lambda: calls.append("backup"))],
+        tracker, ThreadPerCallExecutor())
+    assert (index, result) == (0, "fast")
+    time.sleep(2 * DELAY)
+    assert calls == ["fast"]
+
+
+def test_fast_failover_on_error():
+    """A failing provider triggers the backup immediately, not after the hedge delay"""
+    tracker = LatencyTracker(HedgeSettings(min_samples=1000, default_delay=5.0))
+
+    def fail():
+        raise ValueError("no data")
+
+    start = time.monotonic()
+    assert hedged_call([("broken", fail), ("ok", lambda: "ok")], tracker, ThreadPerCallExecutor()) == (1, "ok")
+    assert time.monotonic() - start < 1
+    assert tracker.stats()["broken"]["failures"] == 1
+
+
+def test_all_providers_failing(tracker):
+    """The error of the last provider is raised if no provider answers"""
+    def fail(message):
+        raise ValueError(message)
+
+    with pytest.raises(ValueError, match="second"):
+        hedged_call([("a", lambda: fail("first")), ("b", lambda: fail("second"))], tracker, ThreadPerCallExecutor())
+    with pytest.raises(ValueError):
+        hedged_call([], tracker, ThreadPerCallExecutor())
+
+
+def test_losers_do_not_block_following_calls(tracker, release):
+    """Slow losers keep running, but following calls are not queued behind them"""
+    executor = ThreadPerCallExecutor()
+    durations = []
+    for _ in range(12):
+        start = time.monotonic()
+        assert hedged_call(
+            [("slow", lambda: release.wait(5) and "slow"), ("fast", lambda: "fast")], tracker, executor) == (1, "fast")
+        durations.append(time.monotonic() - start)
+    assert max(durations) < 0.5
+
+
+def test_single_provider_hedged_with_duplicate(tracker, release, monkeypatch):
+    """A slow request of a single provider API is hedged with a duplicate request to the same endpoint"""
+    requested = []
+
+    class Response:  # pylint: disable=too-few-public-methods
+        """Response of the first answering request"""
+        content = b'[{"symbol": "AAPL"}]'
+
+        def raise_for_status(self):
+            """Always successful"""
+
+    def get(url, params=None, timeout=None):  # pylint: disable=unused-argument
+        requested.append(url)
+        if len(requested) == 1:
+            release.wait(5)
+        return Response()
+
+    monkeypatch.setattr(api_client.requests, "get", get)
+    api = {"base_url": "https://api/search/", "search_param": "", "default_params": {}, "mapping": {}}
+    client = ApiClient({"search": api, "quiet": {**api, "hedge_duplicate": False}}, "key", tracker)
+    assert client.hedge_targets("search") == [0, 0]
+    assert client.hedge_targets("quiet") == [0]
+
+    start = time.monotonic()
+    assert client.fetch("search", "AAPL") == (0, [{"symbol": "AAPL"}])
+    assert time.monotonic() - start < 1
+    assert requested == ["https://api/search/AAPL"] * 2
+
+
+def _async_call(result=None, delay=0.0, error=None, started=None):
+    """Fake coroutine request answering after a delay"""
+    async def call():
+        if started is not None:
+            started.append(result)
+        await asyncio.sleep(delay)
+        if error:
+            raise error
+        return result
+    return call
+
+
+def test_async_hedge_cancels_loser(tracker):
+    """The backup answer wins, the cancelled loser is recorded with its elapsed time"""
+    index, result = asyncio.run(async_hedged_call(
+        [("slow", _async_call("slow", delay=5)), ("fast", _async_call("fast"))], tracker))
+    assert (index, result) == (1, "fast")
+    stats = tracker.stats()
+    assert stats["slow"]["samples"] == 1
+    assert stats["slow"]["p95"] >= DELAY
+    assert stats["slow"]["failures"] == 0
+
+
+def test_async_no_hedge_for_fast_primary(tracker):
+    """A primary answering within the hedge delay gets no backup request"""
+    started = []
+    assert asyncio.run(async_hedged_call(
+        [("fast", _async_call("fast", started=started)), ("backup", _async_call("backup", started=started))],
+        tracker)) == (0, "fast")
+    assert started == ["fast"]
+
+
+def test_async_fast_failover_and_all_failing():
+    """Errors trigger the backup immediately, the last error is raised if all providers fail"""
+    tracker = LatencyTracker(HedgeSettings(min_samples=1000, default_delay=5.0))
+    start = time.monotonic()
+    assert asyncio.run(async_hedged_call(
+        [("broken", _async_call(error=ValueError("no data"))), ("ok", _async_call("ok"))], tracker)) == (1, "ok")
+    assert time.monotonic() - start < 1
+    with pytest.raises(ValueError, match="second"):
+        asyncio.run(async_hedged_call(
+            [("a", _async_call(error=ValueError("first"))), ("b", _async_call(error=ValueError("second")))],
+            tracker))
+    assert tracker.stats()["broken"]["failures"] == 1
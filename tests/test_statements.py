@@ -0,0 +1,77 @@
+"""Tests of financial statements with all periods
+"""
+import sqlite3
+import pytest
+from yasp_dbHandler import statements
+ISIN = "US0378331005"
+INCOME = [
+    {"date": "2023-09-30", "revenue": 383.3, "grossProfit": 169.1, "operatingIncome": 114.3, "netIncome": 97.0,
+     "eps": 6.16},
+    {"date": "2022-09-24", "revenue": 394.3, "grossProfit": 170.8, "operatingIncome": 119.4, "netIncome": 99.8,
+     "eps": None},
+    {"date": "2021-09-25", "revenue": 365.8, "netIncome": 94.7},
+]
+
+
+def test_map_and_get_all_periods(db):
+    """Every period of the response becomes rows, missing values are left out"""
+    rows = db.get_api_client().map_to_statement_rows("income_statement", ISIN, INCOME)
+    assert len(rows) == 5 + 4 + 2
+    assert (ISIN, "2021-09-25", "income", "annual", "revenue", 365.8) in rows
+    statements.insert_rows(db._connection, rows)  # pylint: disable=protected-access
+
+    periods = db.get_statement(ISIN, "income")
+    assert [period["period"] for period in periods] == ["2021-09-25", "2022-09-24", "2023-09-30"]
+    assert periods[0] == {"period": "2021-09-25", "revenue": 365.8, "netIncome": 94.7}
+    assert "eps" not in periods[1]
+    assert db.get_statement(ISIN, "income", ["eps"]) == [{"period": "2023-09-30", "eps": 6.16}]
+    assert not db.get_statement(ISIN, "balance")
+
+
+def test_failing_api_keeps_other_statements(db, fake_api):
+    """A failing statement API does not discard the statements of the others"""
+    db._insert_dict_into_table("stocks", {"isin": ISIN, "symbol": "AAPL"})  # pylint: disable=protected-access
+    fake_api.payloads["income-statement/AAPL"] = INCOME
+    fake_api.payloads["cash-flow-statement/AAPL"] = [{"freeCashFlow": 99.6}]  # no period
+
+    count, failures = db.update_statements(ISIN)
+    assert count == 11
+    assert set(failures) == {"balance_sheet", "cash_flow"}
+    assert len(db.get_statement(ISIN, "income")) == 3
+
+
+def test_annual_and_quarterly_kept_apart(make_db, mapping, fake_api):
+    """Annual and quarterly statements of the same name do not overwrite each other"""
+    mapping["income_quarter"] = {**mapping["income_statement"],
+                                 "default_params": {"period": "quarter", "limit": "4"},
+                                 "base_url": "https://financialmodelingprep.com/api/v3/income-statement-q/"}
+    db = make_db(mapping)
+    db._insert_dict_into_table("stocks", {"isin": ISIN, "symbol": "AAPL"})  # pylint: disable=protected-access
+    fake_api.payloads["income-statement/AAPL"] = INCOME
+    fake_api.payloads["income-statement-q/AAPL"] = [{"date": "2023-09-30", "revenue": 89.5}]
+    db.update_statements(ISIN, ["income_statement", "income_quarter"])
+    assert db.get_statement(ISIN, "income", ["revenue"])[-1] == {"period": "2023-09-30", "revenue": 383.3}
+    assert db.get_statement(ISIN, "income", ["revenue"], "quarter") == [{"period": "2023-09-30", "revenue": 89.5}]
+
+
+def test_duplicate_statement_rejected(make_db, mapping):
+    """Two APIs storing the same statement with the same period type are a configuration error"""
+    mapping["income_copy"] = dict(mapping["income_statement"])
+    with pytest.raises(KeyError, match="income"):
+        make_db(mapping)
+
+
+def test_migrate_table_without_period_type(tmp_path):
+    """Rows of a table without period type are kept and get the period type of their API"""
+    connection = sqlite3.connect(str(tmp_path / "old.db"))
+    connection.execute(
+        "create table financial_statements (isin TEXT, period TEXT, statement TEXT, "
+        "field TEXT, value REAL, PRIMARY KEY (isin, statement, field, period)) WITHOUT ROWID")
+    connection.executemany("INSERT INTO financial_statements VALUES (?, ?, ?, ?, ?)",
+                           [(ISIN, "2023-09-30", "income", "revenue", 383.3),
+                            (ISIN, "2023-09-30", "segments", "revenue", 1.0)])
+    statements.create_tables(connection, {"income": "quarter"})
+    assert statements.select_periods(connection, ISIN, "income", period_type="quarter") == \
+        [{"period": "2023-09-30", "revenue": 383.3}]
+    assert statements.select_periods(connection, ISIN, "segments") == [{"period": "2023-09-30", "revenue": 1.0}]
+    connection.close()
@@ -0,0 +1,116 @@
+"""Tests of the paged stock list source
+"""
+import sqlite3
+import time
+import pytest
+from yasp_dbHandler import stock_list_source
+from yasp_dbHandler.stock_list_source import PagingSettings, StockListSource
+
+PAGE_SIZE = 4
+
+
+def _fill(db):
+    """Stocks with NULLs, ties and two sectors"""
+    prices = [None, 10.0, 5.0, None, 10.0, 7.5, 10.0, None, 1.0, 5.0, None, 12.0, 10.0, 3.0, None, 5.0, 8.0]
+    rows = [(f"XX{index:010d}", price, f"company {index % 5}", "Tech" if index % 3 else "Energy")
+            for index, price in enumerate(prices)]
+    with db._connection:  # pylint: disable=protected-access
+        db._connection.executemany(  # pylint: disable=protected-access
+            "INSERT INTO stocks (isin, price, company, sector) VALUES (?, ?, ?, ?)", rows)
+
+
+def _wait_for(function, timeout=5.0):
+    """Polls a function until it returns a value other than None"""
+    deadline = time.monotonic() + timeout
+    while (result := function()) is None:
+        assert time.monotonic() < deadline, "timeout"
+        time.sleep(0.005)
+    return result
+
+
+def _read_all(source):
+    """Reads the ids of all rows, starting at the last page so that pages are skipped"""
+    count = _wait_for(source.get_row_count)
+    indexes = list(range(count))
+    last_page = (count - 1) // PAGE_SIZE * PAGE_SIZE
+    ids = {index: _wait_for(lambda index=index: source.get_row(index))["id"] for index in indexes[last_page:]}
+    ids.update({index: _wait_for(lambda index=index: source.get_row(index))["id"] for index in indexes})
+    return [ids[index] for index in indexes]
+
+
+@pytest.mark.parametrize("sort_column", ["id", "price", "company"])
+@pytest.mark.parametrize("descending", [False, True])
+@pytest.mark.parametrize("filter_str", [None, {"sector": "Tech"}])
+def test_pages_match_order_by(db, sort_column, descending, filter_str):
+    """Keyset pages return the rows in the order of a plain ORDER BY"""
+    _fill(db)
+    direction = "DESC" if descending else "ASC"
+    where = " WHERE sector = 'Tech'" if filter_str else ""
+    expected = [row[0] for row in db._connection.execute(  # pylint: disable=protected-access
+        f"SELECT id FROM stocks{where} ORDER BY {sort_column} {direction}, id {direction}")]
+
+    source = StockListSource(db, ["id", "price"], PagingSettings(page_size=PAGE_SIZE, prefetch_pages=0))
+    try:
+        source.set_query(sort_column, descending, filter_str)
+        assert _read_all(source) == expected
+    finally:
+        source.close()
+
+
+def test_indexes_created_by_db_handler(db):
+    """The sortable columns are indexed when the database is opened, not by the list"""
+    indexes = {row[0] for row in db._connection.execute(  # pylint: disable=protected-access
+        "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'stocks'")}
+    assert {"idx_stocks_price", "idx_stocks_company", "idx_stocks_watchlist"} <= indexes
+    assert "idx_stocks_description" not in indexes
+
+
+class _LockedOnce:
+    """Connection failing its first query like a database locked by a writer"""
+
+    def __init__(self, connection):
+        self._connection = connection
+        self.failed = False
+
+    def execute(self, *args):
+        """Raises on the first call, then forwards to the connection"""
+        if not self.failed:
+            self.failed = True
+            raise sqlite3.OperationalError("database is locked")
+        return self._connection.execute(*args)
+
+    def close(self):
+        """Closes the connection"""
+        self._connection.close()
+
+
+def test_worker_survives_query_error(db, monkeypatch):
+    """A failed query is retried instead of stopping the worker"""
+    _fill(db)
+    connections = []
+    connect = sqlite3.connect
+    monkeypatch.setattr(stock_list_source.sqlite3, "connect",
+                        lambda *args: connections.append(_LockedOnce(connect(*args))) or connections[-1])
+    source = StockListSource(db, ["id"], PagingSettings(page_size=PAGE_SIZE))
+    try:
+        assert _wait_for(source.get_row_count) == 17
+        assert connections[0].failed
+        source.set_query("price", True)
+        assert len(_read_all(source)) == 17
+    finally:
+        source.close()
+
+
+def test_invalidate_shows_added_rows(db):
+    """Rows added after the first load appear once the source is invalidated by a change listener"""
+    _fill(db)
+    source = StockListSource(db, ["id", "isin"], PagingSettings(page_size=PAGE_SIZE))
+    try:
+        assert _wait_for(source.get_row_count) == 17
+        assert _wait_for(lambda: source.get_row(16))["id"] == 17
+        db.add_change_listener(lambda changes: source.invalidate())
+        db._insert_dict_into_table("stocks", {"isin": "XX9999999999"})  # pylint: disable=protected-access
+        assert _wait_for(lambda: source.get_row_count() if source.get_row_count() != 17 else None) == 18
+        assert _wait_for(lambda: source.get_row(17))["isin"] == "XX9999999999"
+    finally:
+        source.close()